@@ -0,0 +1,365 @@
+import argparse
+import heapq
+import json
+import multiprocessing as mp
+import os
+import resource
+import sys
+import time
+import traceback
+from argparse import Namespace
+from pathlib import Path
+from queue import Empty
+import numpy as np
+"""
+Micro-benchmarks for the analysis hot paths, on synthetic logs.
+
+Benchmarks:
+    parse_latencies         parse_latencies on a text latencies.log
+    parse_latencies_binary  the same samples as a harness/latlog.py binary log
+    aggregate               LatencyHistogram record + merge across clients,
+                            what parse_folder does per trial
+    heapq_merge             the sort + heapq.merge aggregation the histogram
+                            replaced, for reference (skipped above
+                            HEAPQ_MAX_LINES)
+    parse_log               parse_log over a client log of LATENCY/TAIL
+                            summary lines, one parse.compile per line
+    iterate                 parse_data.iterate over a synthetic trial tree
+                            holding the lines across TREE_LOGS client logs,
+                            parse cache off
+
+Latencies are a lognormal body around 10us with a Pareto tail on 1% of the
+samples; send timestamps follow a closed loop. The generated files are kept
+in --workdir and reused, since writing 10^8 text lines takes minutes.
+
+Every benchmark runs in a fresh spawned process, so peak RSS (which counts
+the interpreter and numpy) is its own. The time is the best of --repeat runs.
+A benchmark that raises or dies is reported and skipped, and the exit status
+is then 1.
+
+Usage:
+    python bench.py -n 100000 1000000 -o bench.json
+    python bench.py -n 100000 1000000 -c bench.json
+"""
+BENCHMARKS = ["parse_latencies", "parse_latencies_binary", "aggregate",
+              "heapq_merge", "parse_log", "iterate"]
+DEFAULT_LINES = [100000, 1000000]
+DEFAULT_WORKDIR = "/tmp/echo-bench"
+SEED = 1
+CHUNK = 1000000
+AGGREGATE_CLIENTS = 8
+HEAPQ_MAX_LINES = 10000000
+BODY_NS = 10000
+TAIL_FRACTION = 0.01
+TAIL_NS = 50000
+TREE_SYSTEMS = ["bench_a", "bench_b"]
+TREE_SIZES = [1024, 4096]
+TREE_CLIENTS = [2, 8]
+TREE_MACHINES = 2
+TREE_TRIALS = 2
+POLL_INTERVAL = 1.0  # seconds between checks that a benchmark process is alive
+TREE_LOGS = len(TREE_SYSTEMS) * len(TREE_SIZES) * len(TREE_CLIENTS) * \
+    TREE_TRIALS * TREE_MACHINES
+
+
+def synthetic_chunks(lines, seed=SEED):
+    """
+    Yields (send_times, latencies) int64 arrays of at most CHUNK samples,
+    lines in total.
+    """
+    rng = np.random.default_rng(seed)
+    now = 1700000000 * 1000000000
+    for start in range(0, lines, CHUNK):
+        n = min(CHUNK, lines - start)
+        latencies = rng.lognormal(np.log(BODY_NS), 0.25, n)
+        tail = rng.random(n) < TAIL_FRACTION
+        latencies[tail] = (rng.pareto(1.5, int(tail.sum())) + 1) * TAIL_NS
+        latencies = latencies.astype(np.int64)
+        gaps = latencies + rng.exponential(1000, n).astype(np.int64)
+        sends = now + np.cumsum(gaps) - gaps
+        now = int(sends[-1] + gaps[-1])
+        yield sends, latencies
+
+
+def synthetic_latencies(lines, seed=SEED):
+    if lines == 0:
+        return np.zeros(0, dtype=np.int64)
+    return np.concatenate([latencies for (_, latencies)
+                           in synthetic_chunks(lines, seed)])
+
+
+def write_text_log(path, lines, seed=SEED):
+    with open(path, "w") as f:
+        for (sends, latencies) in synthetic_chunks(lines, seed):
+            pairs = np.column_stack([sends, latencies]).astype(str)
+            f.write("\n".join([" ".join(pair) for pair in pairs]) + "\n")
+
+
+def write_binary_log(path, lines, seed=SEED):
+    from harness.latlog import write_latlog
+    sends = []
+    latencies = []
+    for (chunk_sends, chunk_latencies) in synthetic_chunks(lines, seed):
+        sends.append(chunk_sends)
+        latencies.append(chunk_latencies)
+    write_latlog(path, np.concatenate(latencies), np.concatenate(sends))
+
+
+def write_client_log(path, lines, seed=SEED):
+    """
+    A client log of alternating LATENCY and TAIL LATENCY lines, ending in the
+    retries line.
+    """
+    rng = np.random.default_rng(seed)
+    with open(path, "w") as f:
+        for start in range(0, lines, CHUNK):
+            values = rng.integers(1000, 100000, (min(CHUNK, lines - start), 3))
+            out = []
+            for (idx, (a, b, c)) in enumerate(values, start):
+                if idx == lines - 1:
+                    out.append("Final num retries: {}".format(a % 10))
+                elif idx % 2 == 0:
+                    out.append("LATENCY end-to-end: {} ns {} us/{} ns {} us "
+                               "({} samples, {} ms total)".format(
+                                   a, b // 1000, b, c, a * 10, c))
+                else:
+                    out.append("TAIL LATENCY 99={} ns 99.9={} ns 99.99={} ns".format(
+                        a, b, c))
+            f.write("\n".join(out) + "\n")
+
+
+def write_tree(root, lines, seed=SEED):
+    """
+    A sweep tree in parse_data's layout with lines split across TREE_LOGS
+    client latency logs.
+    """
+    per_log = max(lines // TREE_LOGS, 1)
+    latencies_log = Path(root).with_suffix(".latencies.log")
+    client_log = Path(root).with_suffix(".summary.log")
+    write_text_log(latencies_log, per_log, seed)
+    write_client_log(client_log, 3, seed)
+    for system in TREE_SYSTEMS:
+        for size in TREE_SIZES:
+            for num_clients in TREE_CLIENTS:
+                for trial in range(0, TREE_TRIALS):
+                    folder = Path(root) / system / "Get" / "size_{}".format(size) / \
+                        "{}clients".format(num_clients) / "trial_{}".format(trial)
+                    os.makedirs(folder, exist_ok=True)
+                    with open(folder / "experiment.json", "w") as f:
+                        json.dump({"clients": ["client{}".format(i) for i in
+                                               range(1, TREE_MACHINES + 1)]}, f)
+                    # every client shares the same logs through hard links
+                    for i in range(1, TREE_MACHINES + 1):
+                        os.link(latencies_log, folder / "client{}.latencies.log".format(i))
+                        os.link(client_log, folder / "client{}.log".format(i))
+    os.remove(latencies_log)
+    os.remove(client_log)
+
+
+def prepare(workdir, benchmark, lines):
+    """
+    Generates the input of a benchmark in workdir unless it is already there;
+    returns its path, or None for benchmarks that generate in memory.
+    """
+    generators = {"parse_latencies": ("latencies_{}.log", write_text_log),
+                  "parse_latencies_binary": ("latencies_{}.bin", write_binary_log),
+                  "parse_log": ("client_{}.log", write_client_log),
+                  "iterate": ("tree_{}", write_tree)}
+    if benchmark not in generators:
+        return None
+    name, generate = generators[benchmark]
+    path = Path(workdir) / name.format(lines)
+    if not os.path.exists(path):
+        os.makedirs(workdir, exist_ok=True)
+        partial = Path(workdir) / ("partial_" + path.name)
+        generate(partial, lines)
+        os.rename(partial, path)
+    return path
+
+
+def client_parts(lines):
+    latencies = synthetic_latencies(lines)
+    return np.array_split(latencies, AGGREGATE_CLIENTS)
+
+
+def run_once(benchmark, path, lines, state):
+    if benchmark in ("parse_latencies", "parse_latencies_binary"):
+        from parse_data import parse_latencies
+        parse_latencies(str(path))
+    elif benchmark == "aggregate":
+        from harness.histogram import LatencyHistogram
+        trial_hist = LatencyHistogram()
+        for part in state:
+            trial_hist += LatencyHistogram.from_latencies(part)
+        trial_hist.summary()
+    elif benchmark == "heapq_merge":
+        merged = list(heapq.merge(*[sorted(part.tolist()) for part in state]))
+        merged[int(len(merged) * 0.99)]
+    elif benchmark == "parse_log":
+        from parse_data import parse_log
+        parse_log(str(path))
+    elif benchmark == "iterate":
+        from parse_data import iterate
+        iterate(None, Namespace(logfile=str(path), systems=[], sizes=[],
+                                num_clients=[], no_cache=True, trim="fixed",
+                                series=False))
+
+
+def own_peak_rss_kb():
+    # ru_maxrss survives exec, so a spawned process would inherit the peak of
+    # the parent it was forked from; VmHWM starts over with the new image
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def peak_rss_kb():
+    # in KiB; iterate's pool workers are children
+    return max(own_peak_rss_kb(),
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+
+def measure(benchmark, path, lines, repeat, queue):
+    try:
+        queue.put(run_measure(benchmark, path, lines, repeat))
+    except Exception:
+        queue.put({"error": traceback.format_exc()})
+
+
+def run_measure(benchmark, path, lines, repeat):
+    # run in a fresh process: imports happen before the baseline RSS
+    import parse_data
+    # parse_folder reports every trial folder on stderr
+    sys.stderr = open(os.devnull, "w")
+    if benchmark == "iterate":
+        lines = max(lines // TREE_LOGS, 1) * TREE_LOGS
+    state = None
+    if benchmark in ("aggregate", "heapq_merge"):
+        state = client_parts(lines)
+    base_rss = peak_rss_kb()
+    times = []
+    for _ in range(0, repeat):
+        start = time.perf_counter()
+        run_once(benchmark, path, lines, state)
+        times.append(time.perf_counter() - start)
+    return {"benchmark": benchmark, "lines": lines, "seconds": min(times),
+            "lines_per_s": lines / min(times),
+            "base_rss_mb": base_rss / 1024.0,
+            "peak_rss_mb": peak_rss_kb() / 1024.0}
+
+
+def run_benchmark(benchmark, path, lines, repeat):
+    ctx = mp.get_context("spawn")
+    queue = ctx.Queue()
+    process = ctx.Process(target=measure,
+                          args=(benchmark, path, lines, repeat, queue))
+    process.start()
+    try:
+        while True:
+            try:
+                result = queue.get(timeout=POLL_INTERVAL)
+                break
+            except Empty:
+                if process.is_alive():
+                    continue
+            # the result may have been sent just before the process exited
+            try:
+                result = queue.get(timeout=POLL_INTERVAL)
+                break
+            except Empty:
+                raise RuntimeError("{} at {} lines exited with code {} and no result".format(
+                    benchmark, lines, process.exitcode))
+    finally:
+        process.join(POLL_INTERVAL)
+        if process.is_alive():
+            process.terminate()
+            process.join()
+    if "error" in result:
+        raise RuntimeError("{} at {} lines failed:\n{}".format(
+            benchmark, lines, result["error"]))
+    return result
+
+
+def result_key(result):
+    return "{}@{}".format(result["benchmark"], result["lines"])
+
+
+def print_results(results, baseline=None):
+    print("{:<24} {:>11} {:>10} {:>14} {:>10} {:>10}{}".format(
+        "benchmark", "lines", "best s", "lines/s", "base MB", "peak MB",
+        "" if baseline is None else " {:>9}".format("vs base")))
+    for result in results:
+        compared = ""
+        if baseline is not None:
+            old = baseline.get(result_key(result))
+            compared = " {:>9}".format("NA" if old is None else "{:.2f}x".format(
+                result["lines_per_s"] / old["lines_per_s"]))
+        print("{:<24} {:>11} {:>10.3f} {:>14.0f} {:>10.1f} {:>10.1f}{}".format(
+            result["benchmark"], result["lines"], result["seconds"],
+            result["lines_per_s"], result["base_rss_mb"], result["peak_rss_mb"],
+            compared))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--lines",
+                        help = "Log lines per benchmark",
+                        type = int,
+                        nargs = "+",
+                        default = DEFAULT_LINES)
+    parser.add_argument("-b", "--benchmarks",
+                        nargs = "+",
+                        choices = BENCHMARKS,
+                        default = BENCHMARKS)
+    parser.add_argument("-r", "--repeat",
+                        help = "Runs per benchmark; the best is reported",
+                        type = int,
+                        default = 3)
+    parser.add_argument("-w", "--workdir",
+                        help = "Folder for the generated logs, reused across runs",
+                        default = DEFAULT_WORKDIR)
+    parser.add_argument("-o", "--outfile",
+                        help = "Write the results to this JSON file",
+                        default = None)
+    parser.add_argument("-c", "--compare",
+                        help = "JSON results of an earlier run to compare against",
+                        default = None)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    baseline = None
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    results = []
+    failed = 0
+    for lines in args.lines:
+        for benchmark in args.benchmarks:
+            if benchmark == "heapq_merge" and lines > HEAPQ_MAX_LINES:
+                print("Skipping heapq_merge at {} lines".format(lines),
+                      file=sys.stderr)
+                continue
+            path = prepare(args.workdir, benchmark, lines)
+            try:
+                results.append(run_benchmark(benchmark, path, lines, args.repeat))
+            except RuntimeError as e:
+                print(e, file=sys.stderr)
+                failed += 1
+    print_results(results, baseline)
+    if args.outfile is not None:
+        with open(args.outfile, "w") as f:
+            json.dump({result_key(result): result for result in results}, f,
+                      indent=1)
+    if failed > 0:
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,22 @@
 import argparse
+import asyncio
+import json
+import math
 import os
-import sys
-import multiprocessing
-from fabric import Connection
-import yaml
+import queue
+import shlex
+import threading
 import time
+import yaml
+from stats import relative_ci_width, trials_to_reach
+from regress import DEFAULT_ALPHA, DEFAULT_METRICS
+from harness.latlog import convert_log, count_records
+from journal import SweepJournal, requeue_folder, PENDING, RUNNING, DONE, FAILED, DEFAULT_MAX_ATTEMPTS
+from perf_stat import perf_events_arg
+from profiles import PERF_DATA, PERF_SCRIPT, FOLDED, DEFAULT_FREQUENCY, fold_trial
+from placement import DEFAULT_PLACEMENT, parse_cores, format_cores, placement_tag, exp_suffix
+from harness.remote import debug, timed_phase, report_phase_times, close_connections, remote_sudo, remote_check, wait_for_exit, run_cmd, run_remote, orchestrate, SERVER_EXIT_TIMEOUT, CLIENT_EXIT_TIMEOUT
+from telemetry import TELEMETRY_RAW, TELEMETRY, SAMPLER_NAME, DEFAULT_INTERVAL, sampler_cmd, compact
 """
 Goal of this script: common functions to run a simple benchmark.
 Usage:
@@ -35,14 +47,12 @@ MESSAGES = ["Get", "Msg1L", "Msg2L",
             "Msg3L", "Msg4L", "Msg5L"]
 NUM_TRIALS = 10  # finish trials 4 and 5 later
 MAX_CLIENTS = 10
+EXPERIMENT_RESULT = "experiment.json"
+MIN_SAMPLE_FRACTION = 0.9  # of -i, below which a client's latency log is incomplete
+SEARCH_FOLDER = "search"  # under the logfile, holds the levels of saturation searches
 ######################################################################
 
 
-def debug(*args):
-    prepend = "\u2192"
-    print(prepend, *args, file=sys.stderr)
-
-
 def parse_args():
     parser = argparse.ArgumentParser()
     parser.add_argument("-y", "--yaml",
@@ -85,9 +95,83 @@ def parse_args():
     parser.add_argument("-pf", "--perf",
                         help="Run perf server side to observe cache statistics",
                         action="store_true")
+    parser.add_argument("-pr", "--profile",
+                        help="Sample server call stacks with perf record and fold them after each run",
+                        action="store_true")
+    parser.add_argument("-pfq", "--profile_freq",
+                        help="perf record sampling frequency (Hz) for --profile",
+                        type=int,
+                        default=DEFAULT_FREQUENCY)
+    parser.add_argument("-sc", "--server_cores",
+                        help="Cores to pin the server to, e.g. 0-3,8 (default: core 0, or all of --numa_node)",
+                        default=None)
+    parser.add_argument("-nn", "--numa_node",
+                        help="Bind the server's cores and memory to this NUMA node",
+                        type=int,
+                        default=None)
+    parser.add_argument("-cc", "--client_cores",
+                        help="Cores to pin each client process to",
+                        default=None)
+    parser.add_argument("-cn", "--core_counts",
+                        help="Sweep the server over the first k of --server_cores for each k",
+                        type=int,
+                        nargs="+",
+                        default=None)
+    parser.add_argument("-tm", "--telemetry",
+                        help="Sample CPU, interrupt, NIC and memory bandwidth counters on every host during each run",
+                        action="store_true")
+    parser.add_argument("-ti", "--telemetry_interval",
+                        help="Telemetry sampling interval in seconds",
+                        type=float,
+                        default=DEFAULT_INTERVAL)
     parser.add_argument("-z", "--zero_copy",
                         help="Zero copy mode on",
                         action="store_true")
+    parser.add_argument("-ad", "--adaptive",
+                        help="Stop repeating a configuration once its tput and p99 confidence intervals are narrow enough",
+                        action="store_true")
+    parser.add_argument("-ci", "--ci_width",
+                        help="Target 95%% confidence interval width, relative to the mean, for --adaptive",
+                        type=float,
+                        default=0.05)
+    parser.add_argument("-mint", "--min_trials",
+                        help="Minimum trials per configuration for --adaptive. regress.py's exact test needs at least 4 per side to reach p < 0.05, and more once its Holm adjustment multiplies by the number of compared points, so the sweep also runs the count regress needs for its configurations (up to --max_trials)",
+                        type=int,
+                        default=4)
+    parser.add_argument("-maxt", "--max_trials",
+                        help="Maximum trials per configuration for --adaptive",
+                        type=int,
+                        default=NUM_TRIALS)
+    parser.add_argument("-se", "--search",
+                        help="Search for each system and size's saturation point instead of sweeping a fixed client list",
+                        action="store_true")
+    parser.add_argument("-slo", "--slo",
+                        help="p99 latency SLO in us for --search",
+                        type=float,
+                        default=None)
+    parser.add_argument("-kt", "--knee_threshold",
+                        help="Minimum relative tput gain for a higher load to count as still rising (--search)",
+                        type=float,
+                        default=0.05)
+    parser.add_argument("-mc", "--max_concurrency",
+                        help="Maximum client threads per machine for --search",
+                        type=int,
+                        default=16)
+    parser.add_argument("-rs", "--refine_steps",
+                        help="Bisection steps around the knee for --search",
+                        type=int,
+                        default=3)
+    parser.add_argument("-tb", "--testbeds",
+                        help="Split the yaml hosts into this many disjoint testbeds and run points on them in parallel; each server host needs its own config_path",
+                        type=int,
+                        default=1)
+    parser.add_argument("-cl", "--compact_logs",
+                        help="Convert client latency logs to the binary format after each run",
+                        choices=["varint", "zstd"])
+    parser.add_argument("-ma", "--max_attempts",
+                        help="Runs of a point whose outputs fail validation before the sweep gives up on it",
+                        type=int,
+                        default=DEFAULT_MAX_ATTEMPTS)
     return parser.parse_args()
 
 
@@ -111,23 +195,34 @@ def calculate_log_path(args, trial, exp, size, message=None):
             trial)
 
 
-def connection(args, host):
-    cxn = Connection(host=host,
-                     user=args["user"],
-                     port=22,
-                     connect_kwargs={"key_filename": args["key"]})
-    return cxn
-
-
 # kill any rogue processes on server
 def cleanup(args):
     cleanup_server(args)
-    for idx in range(1, 11):
-        kill_client(args, idx)
+    # client hosts are independent, so wait for them in parallel
+    killers = [threading.Thread(target=kill_client, args=(args, idx))
+               for idx in range(1, num_client_hosts(args) + 1)]
+    for killer in killers:
+        killer.start()
+    for killer in killers:
+        killer.join()
     debug("Done with  cleanup, starting experiment.")
 
 
-def start_server(args, trial, exp, size, message=None):
+def server_pinning(placement):
+    """
+    Command prefix that confines the server to its placement: numactl for a
+    NUMA node (memory included), taskset for an explicit core list.
+    """
+    prefix = []
+    if placement.get("numa_node") is not None:
+        prefix.append("numactl --cpunodebind={0} --membind={0}".format(
+            placement["numa_node"]))
+    if placement.get("server_cores"):
+        prefix.append("taskset -c {}".format(format_cores(placement["server_cores"])))
+    return " ".join(prefix)
+
+
+def server_cmd(args, trial, exp, size, message=None):
     # prepare the logpath
     # for perf: prepend something like
     # perf stat -e task-clock,cycles, instructions,cache-references,cache-misses
@@ -135,14 +230,15 @@ def start_server(args, trial, exp, size, message=None):
     if not args["pprint"]:
         os.makedirs(calculate_log_path(
             args, trial, exp, size, message), exist_ok=True)
-    cmd = "sudo nice -n -20 taskset 0x1 "
+    cmd = "sudo nice -n -20 {} ".format(
+        server_pinning(args.get("placement", DEFAULT_PLACEMENT)))
     if args["perf"]:
         debug("Running with perf")
-        cmd += "perf stat -e "
-        cmd += "task-clock,cycles,instructions,cache-references,cache-misses"
-        cmd += ",L1-dcache-loads,L1-dcache-load-misses,L1-dcache-stores"
-        cmd += ",dTLB-loads,dTLB-load-misses,dTLB-prefetch-misses"
-        cmd += ",LLC-loads,LLC-load-misses,LLC-stores,LLC-prefetch"
+        cmd += "perf stat -e {}".format(perf_events_arg())
+    elif args.get("profile"):
+        cmd += "perf record -F {} -g -o {}/{}".format(
+            args["profile_freq"],
+            calculate_log_path(args, trial, exp, size, message), PERF_DATA)
     cmd += " {exec_dir}/{libos}-server --port {port} --config-path {config_path}".format(
         **args)
     host = args["hosts"]["server"]["addr"]
@@ -157,24 +253,35 @@ def start_server(args, trial, exp, size, message=None):
     # for the zero copy experiments
     if args["zero_copy"]:
         cmd += " --zero-copy"
+    # servers that can run one thread per core take the count as a flag
+    if args.get("server_cores_flag") is not None and \
+            args.get("placement", DEFAULT_PLACEMENT)["server_cores"]:
+        cmd += " {} {}".format(args["server_cores_flag"],
+                               len(args["placement"]["server_cores"]))
     logpath = "{}/server".format(calculate_log_path(args, trial, exp, size,
                                                     message))
     cmd += " > {} 2> {}".format("{}.log".format(logpath),
                                 "{}.err.log".format(logpath))
+    return host, cmd
+
 
+def start_server(args, trial, exp, size, message=None):
+    host, cmd = server_cmd(args, trial, exp, size, message)
     if args["pprint"]:
         debug(host, ": ", cmd)
 
-    proc = multiprocessing.Process(
+    proc = threading.Thread(
         target=run_cmd, args=(cmd, host, args, True))
     return proc
 
 
-def start_client(args, idx, trial, exp, size, message=None, iteration_multiplier=1):
-    original_iterations = args["iterations"]
-    args["iterations"] = original_iterations * args["clients"]
-    cmd = "sudo {exec_dir}/{libos}-client --port {port} --config-path {config_path} -i {iterations}".format(
+def client_cmd(args, idx, trial, exp, size, message=None):
+    cmd = "sudo "
+    if args.get("client_cores") is not None:
+        cmd += "taskset -c {} ".format(format_cores(args["client_cores"]))
+    cmd += "{exec_dir}/{libos}-client --port {port} --config-path {config_path}".format(
         **args)
+    cmd += " -i {}".format(args["iterations"] * args["clients"])
     if args["retry"]:
         cmd += " --retry"
     cmd += " -s {}".format(size)
@@ -196,75 +303,138 @@ def start_client(args, idx, trial, exp, size, message=None, iteration_multiplier
     cmd += " --latlog {}.latencies.log".format(logpath)
     cmd += " > {} 2> {}".format("{}.log".format(logpath),
                                 "{}.err.log".format(logpath))
+    return host, cmd
+
+
+def start_client(args, idx, trial, exp, size, message=None, iteration_multiplier=1):
+    host, cmd = client_cmd(args, idx, trial, exp, size, message)
     if args["pprint"]:
         debug(host, ": ", cmd)
         return
 
-    proc = multiprocessing.Process(target=run_cmd, args=(cmd, host, args))
-    args["iterations"] = original_iterations
+    proc = threading.Thread(target=run_cmd, args=(cmd, host, args))
     return proc
 
 
-def cleanup_server(args):
+def stop_server(args):
     host = args["hosts"]["server"]["addr"]
-    cxn = connection(args, host)
-    try:
-        cxn.sudo(
-            "sudo kill  -9 `ps aux | grep {exec_dir}/{libos}-server | awk '{{print $2}}' | head -n3`".format(**args), hide=True)
-        time.sleep(10)
-        cxn.sudo("sudo killall {libos}-server".format(**args), hide=True)
-        debug("Killed server")
-    except:
+    binary = "{exec_dir}/{libos}-server".format(**args)
+    with timed_phase("server_exit"):
+        if args.get("profile"):
+            # perf record only writes a usable file if it is interrupted
+            # rather than killed; it then terminates the server itself
+            remote_check(args, host, "sudo pkill -INT -f '^perf record'")
+            wait_for_exit(args, host, "perf record", SERVER_EXIT_TIMEOUT)
+        elif args["perf"]:
+            # likewise perf stat only prints its counters if it is
+            # interrupted, and it prints them once the server it runs has
+            # exited; the kill -9 below would match perf stat as well
+            remote_check(args, host, "sudo pkill -INT -f '^perf stat'")
+            remote_check(args, host, "sudo pkill -9 -f {}".format(
+                shlex.quote("^" + binary)))
+            wait_for_exit(args, host, "perf stat", SERVER_EXIT_TIMEOUT)
+        try:
+            remote_sudo(args, host,
+                "sudo kill -9 `ps aux | grep {} | awk '{{print $2}}' | head -n3`".format(binary), hide=True)
+        except:
+            pass
+        if wait_for_exit(args, host, binary, SERVER_EXIT_TIMEOUT):
+            debug("Killed server")
+            return True
         try:
-            cxn.sudo("sudo killall {libos}-server".format(**args), hide=True)
+            remote_sudo(args, host, "sudo killall {libos}-server".format(**args), hide=True)
             debug("Used killall to kill server")
+            return wait_for_exit(args, host, binary, SERVER_EXIT_TIMEOUT)
         except:
             return False
-        return False
+
+
+def cleanup_server(args):
+    return stop_server(args)
 
 
 def kill_server(args):
-    host = args["hosts"]["server"]["addr"]
-    cxn = connection(args, host)
-    try:
-        cxn.sudo(
-            "sudo kill -9 `ps aux | grep {exec_dir}/{libos}-server | awk '{{print $2}}' | head -n3`".format(**args), hide=True)
-        time.sleep(10)
-        cxn.sudo("sudo killall {libos}-server".format(**args), hide=True)
-        debug("Killed server")
-        return
-    except:
-        try:
-            cxn.sudo("sudo killall {libos}-server".format(**args), hide=True)
-            debug("Used killall to kill server")
-        except:
-            return False
-        return False
+    return stop_server(args)
 
 
 def kill_client(args, idx):
     host = args["hosts"]["client{}".format(idx)]["addr"]
-    cxn = connection(args, host)
-    try:
-        # send 2 -> interrupt from keyboard
-        cxn.sudo(
-            "sudo kill  -9 `ps aux | grep {exec_dir}/{libos}-client | awk '{{print $2}}' | head -n3`".format(**args), hide=True)
-        time.sleep(2)
-    except:
-        return False
+    binary = "{exec_dir}/{libos}-client".format(**args)
+    with timed_phase("client_exit"):
+        try:
+            # send 2 -> interrupt from keyboard
+            remote_sudo(args, host,
+                "sudo kill  -9 `ps aux | grep {} | awk '{{print $2}}' | head -n3`".format(binary), hide=True)
+        except:
+            pass
+        return wait_for_exit(args, host, binary, CLIENT_EXIT_TIMEOUT)
 
 
-def run_cmd(cmd, host, args, fail_ok=False):
-    cxn = connection(args, host)
+def clock_offset(args, host):
+    """
+    host's clock minus the harness's, in ns, from one round trip of date
+    (accurate to half the round trip); None if it could not be read.
+    """
+    before = time.time_ns()
     try:
-        res = cxn.sudo(cmd, hide=True)
-        res.stdout.strip()
-        return
-    except:
-        if not fail_ok:
-            debug("Failed to run cmd {} on host {}.".format(cmd, host))
+        res = remote_sudo(args, host, "date +%s%N", hide=True, warn=True)
+        remote_ns = int(res.stdout.strip())
+    except Exception:
+        return None
+    return remote_ns - (before + time.time_ns()) // 2
 
-        return
+
+def start_telemetry(args, logpath, clients):
+    """
+    Starts a telemetry sampler on the server and on every client host of the
+    run; returns [(role, host, thread, clock offset)].
+    """
+    hosts = [("server", args["hosts"]["server"]["addr"])]
+    for (idx, host, _) in clients:
+        if host not in [sampled for (_, sampled) in hosts]:
+            hosts.append(("client{}".format(idx), host))
+    samplers = []
+    for (role, host) in hosts:
+        offset = clock_offset(args, host)
+        cmd = sampler_cmd("{}/{}".format(logpath, TELEMETRY_RAW.format(role)),
+                          args["telemetry_interval"])
+        thread = threading.Thread(target=run_remote,
+                                  args=(args, host, cmd, "{}_telemetry".format(role)))
+        thread.start()
+        samplers.append((role, host, thread, offset))
+    return samplers
+
+
+def stop_telemetry(args, logpath, samplers):
+    """
+    Stops the samplers and compacts their dumps into the trial folder;
+    returns the roles that produced telemetry.
+    """
+    recorded = []
+    with timed_phase("telemetry"):
+        for (role, host, thread, _) in samplers:
+            # the bracket keeps pkill from matching the shell running it
+            remote_check(args, host, "pkill -f '[{}]{}'".format(
+                SAMPLER_NAME[0], SAMPLER_NAME[1:]))
+            thread.join(SERVER_EXIT_TIMEOUT)
+            raw = "{}/{}".format(logpath, TELEMETRY_RAW.format(role))
+            if os.path.exists(raw) and \
+                    compact(raw, "{}/{}".format(logpath, TELEMETRY.format(role))):
+                recorded.append(role)
+            else:
+                debug("No telemetry from {} ({})".format(role, host))
+    return recorded
+
+
+def num_client_hosts(args):
+    return len([name for name in args["hosts"] if name.startswith("client")])
+
+
+def exp_name(num_clients, clients, placement=None):
+    suffix = exp_suffix(placement) if placement is not None else ""
+    if clients > 1:
+        return "{}clients{}".format(num_clients * clients, suffix)
+    return "{}clients{}".format(num_clients, suffix)
 
 
 def run_tput_exp(args, trial, size, num_clients, message=None):
@@ -272,73 +442,519 @@ def run_tput_exp(args, trial, size, num_clients, message=None):
     # know how many clients per script
     debug("Num clients: {}".format(num_clients))
     # start server
-    exp = "{}clients".format(num_clients)
-    if args["clients"] > 1:
-        exp = "{}clients".format(num_clients * args["clients"])
-    if os.path.exists(calculate_log_path(args, trial, exp, size, message)):
-        debug("Exp: trial {}, size {}, system {}, message {}, clients {} exists, skipping".format(
+    exp = exp_name(num_clients, args["clients"], args.get("placement"))
+    logpath = calculate_log_path(args, trial, exp, size, message)
+    journal = args.get("journal")
+    if os.path.exists(logpath):
+        # the journal vouches for the sample counts of points it saw finish;
+        # anything else may be left over from a crashed or failed run
+        problems = validate_trial(args, logpath, num_clients, count=(
+            journal is None or journal.state(logpath) != DONE))
+        if len(problems) == 0:
+            debug("Exp: trial {}, size {}, system {}, message {}, clients {} exists, skipping".format(
+                trial,
+                size,
+                args["system"],
+                message,
+                num_clients * args["clients"]))
+            if journal is not None and journal.state(logpath) != DONE:
+                journal.record(logpath, DONE)
+            return
+        debug("Exp: trial {}, size {}, system {}, message {}, clients {} is incomplete ({}), running it again".format(
             trial,
             size,
             args["system"],
             message,
-            num_clients * args["clients"]))
-        return
+            num_clients * args["clients"],
+            "; ".join(problems)))
+        if not args["pprint"]:
+            debug("Moved the incomplete trial to {}".format(
+                requeue_folder(args["logfile"], logpath)))
     debug("Running exp: trial {}, size {}, system {}, message {}, clients {}".format(
         trial,
         size,
         args["system"],
         message,
         num_clients * args["clients"]))
-    server_proc = start_server(args, trial, exp, size, message)
-    if not args["pprint"]:
-        server_proc.start()
-        time.sleep(3)
-
-    # start each client
-    client_procs = []
-    for i in range(1, min(MAX_CLIENTS + 1, num_clients + 1)):
-        iteration_multiplier = 1
-        client_procs.append(start_client(
-            args, i, trial, exp, size, message, iteration_multiplier))
+    server = server_cmd(args, trial, exp, size, message)
+    clients = []
+    for i in range(1, min(num_client_hosts(args), num_clients) + 1):
+        host, cmd = client_cmd(args, i, trial, exp, size, message)
+        clients.append((i, host, cmd))
 
     if args["pprint"]:
+        for (host, cmd) in [server] + [(host, cmd) for (_, host, cmd) in clients]:
+            debug(host, ": ", cmd)
         return
 
-    # start and join each client and kill server
-    for proc in client_procs:
-        proc.start()
+    if journal is not None:
+        journal.record(logpath, RUNNING, testbed=args.get("testbed", 0))
+    try:
+        experiment = run_experiment(args, logpath, server, clients)
+    except BaseException as e:
+        # interrupted or crashed; a restart validates and reruns the point
+        if journal is not None:
+            journal.record(logpath, FAILED, problems=[repr(e)])
+        raise
+    if journal is not None:
+        journal.record(logpath, FAILED if len(experiment["problems"]) > 0 else DONE,
+                       problems=experiment["problems"])
+    return experiment
+
 
-    for proc in client_procs:
-        proc.join()
-        debug("\u2192Client done.")
-    kill_server(args)
-    return
+def run_experiment(args, logpath, server, clients):
+    samplers = []
+    if args.get("telemetry"):
+        samplers = start_telemetry(args, logpath, clients)
+    experiment = asyncio.run(orchestrate(
+        args, server, clients, "{}/server.log".format(logpath), kill_server,
+        kill_client))
+    if len(samplers) > 0:
+        experiment["telemetry"] = {"interval": args["telemetry_interval"],
+                                   "libos": args["libos"],
+                                   "hosts": stop_telemetry(args, logpath, samplers),
+                                   "clock_offsets": {role: offset for (role, _, _, offset)
+                                                     in samplers}}
+    experiment["testbed"] = args.get("testbed", 0)
+    placement = args.get("placement", DEFAULT_PLACEMENT)
+    experiment["placement"] = dict(placement, tag=placement_tag(placement),
+                                   client_cores=args.get("client_cores"))
+    if args.get("profile"):
+        experiment["profile"] = fold_server_profile(args, logpath)
+    experiment["problems"] = validate_trial(args, logpath, len(clients), experiment)
+    for problem in experiment["problems"]:
+        debug("Invalid trial {}: {}".format(logpath, problem))
+    with open("{}/{}".format(logpath, EXPERIMENT_RESULT), "w") as f:
+        json.dump(experiment, f, indent=2)
+    if args.get("compact_logs") is not None:
+        for (i, _, _) in clients:
+            log = "{}/client{}.latencies.log".format(logpath, i)
+            if os.path.exists(log):
+                convert_log(log, args["compact_logs"] == "zstd")
+    return experiment
 
 
-def cycle_exps(args):
-    original_clients = args["clients"]
-    for trial in range(0, NUM_TRIALS):
+def validate_trial(args, logpath, num_clients, experiment=None, count=True):
+    """
+    Reasons a trial's outputs cannot be used; empty if it is valid. The
+    clients must all have succeeded, and every client machine must have
+    left a latency log with at least MIN_SAMPLE_FRACTION of the samples its
+    -i asked for; without count, the logs only have to be non-empty.
+    """
+    problems = []
+    if experiment is None:
+        experiment_file = "{}/{}".format(logpath, EXPERIMENT_RESULT)
+        if os.path.exists(experiment_file):
+            try:
+                with open(experiment_file) as f:
+                    experiment = json.load(f)
+            except (OSError, ValueError):
+                problems.append("{} is unreadable".format(EXPERIMENT_RESULT))
+    if experiment is not None and not experiment.get("ok", True):
+        problems.append("a client failed or timed out")
+    expected = args["iterations"] * args["clients"]
+    for i in range(1, min(num_client_hosts(args), num_clients) + 1):
+        log = "{}/client{}.latencies.log".format(logpath, i)
+        if not os.path.exists(log) or os.path.getsize(log) == 0:
+            problems.append("client{} latency log is missing or empty".format(i))
+            continue
+        if not count:
+            continue
+        samples = count_records(log)
+        if samples < expected * args.get("min_sample_fraction", MIN_SAMPLE_FRACTION):
+            problems.append("client{} logged {} of {} samples".format(i, samples, expected))
+    return problems
+
+
+def fold_server_profile(args, logpath):
+    """
+    Symbolizes the run's perf samples on the server (where the binary and its
+    libraries live), then folds them into FOLDED next to the other logs.
+    """
+    host = args["hosts"]["server"]["addr"]
+    with timed_phase("profile_fold"):
+        try:
+            remote_sudo(args, host, "perf script -f -i {0}/{1} > {0}/{2}".format(
+                logpath, PERF_DATA, PERF_SCRIPT), hide=True)
+        except Exception as e:
+            debug("perf script failed on {}: {}".format(host, e))
+        samples = fold_trial(logpath)
+    if samples is None:
+        debug("No profile samples in {}".format(logpath))
+    return {"frequency": args["profile_freq"], "samples": samples,
+            "folded": FOLDED if samples is not None else None}
+
+
+def experiment_points(args, num_trials=NUM_TRIALS):
+    """
+    Every (trial, system, size, message, clients, placement) point of the
+    sweep, in the order cycle_exps runs them serially.
+    """
+    points = []
+    for trial in range(0, num_trials):
         # cycle through all the systems provided
         for system in args["systems"]:
-            debug("Cycling for system {}.".format(system))
-            args["system"] = system
             if args["experiment"] == "size":
                 for size in reversed(SIZES):
                     for (num_clients, concurrent) in args["clients_list"]:
-                        args["clients"] = concurrent
-                        message = BASE_MESSAGE if "baseline" not in args["system"] else None
-                        run_tput_exp(args, trial, size, num_clients, message)
-                        args["clients"] = original_clients
+                        message = BASE_MESSAGE if "baseline" not in system else None
+                        points.append({"trial": trial, "system": system,
+                                       "size": size, "message": message,
+                                       "num_clients": num_clients,
+                                       "clients": concurrent})
             else:
                 for message in MESSAGES:
-                    for num_clients in args["clients_list"]:
-                        if num_clients > MAX_CLIENTS:
-                            num_clients = MAX_CLIENTS
-                            args["clients"] = num_clients / MAX_CLIENTS
-                        #debug("Exp: sys {}, size {}, message {}, num clients {}, concurrent clients {}".format(args["system"], size, message, num_clients, args["clients"]))
-                        run_tput_exp(args, trial, BASE_SIZE,
-                                     num_clients, message)
-                        args["clients"] = original_clients
+                    for (num_clients, concurrent) in args["clients_list"]:
+                        points.append({"trial": trial, "system": system,
+                                       "size": BASE_SIZE, "message": message,
+                                       "num_clients": num_clients,
+                                       "clients": concurrent})
+    placements = args.get("placements", [DEFAULT_PLACEMENT])
+    return [dict(point, placement=placement)
+            for point in points for placement in placements]
+
+
+def run_point(args, point):
+    point_args = dict(args)
+    point_args["system"] = point["system"]
+    point_args["clients"] = point["clients"]
+    point_args["placement"] = point.get("placement", DEFAULT_PLACEMENT)
+    return run_tput_exp(point_args, point["trial"], point["size"],
+                        point["num_clients"], point["message"])
+
+
+def point_log_path(args, point):
+    point_args = dict(args)
+    point_args["system"] = point["system"]
+    exp = exp_name(point["num_clients"], point["clients"],
+                   point.get("placement", DEFAULT_PLACEMENT))
+    return calculate_log_path(point_args, point["trial"], exp, point["size"],
+                              point["message"])
+
+
+def requeue(args, point):
+    """
+    Whether a point that just ran should be run again: its outputs failed
+    validation and it has attempts left in this sweep.
+    """
+    journal = args.get("journal")
+    if journal is None or args["pprint"]:
+        return False
+    logpath = point_log_path(args, point)
+    if journal.state(logpath) != FAILED:
+        return False
+    if journal.attempts_of(logpath) >= args.get("max_attempts", DEFAULT_MAX_ATTEMPTS):
+        debug("Giving up on {} after {} attempts".format(
+            journal.key(logpath), journal.attempts_of(logpath)))
+        return False
+    debug("Re-queueing {}".format(journal.key(logpath)))
+    return True
+
+
+def run_point_until_valid(args, point):
+    run_point(args, point)
+    while requeue(args, point):
+        run_point(args, point)
+
+
+def queue_points(args, points):
+    journal = args.get("journal")
+    if journal is None or args["pprint"]:
+        return
+    for point in points:
+        logpath = point_log_path(args, point)
+        if journal.state(logpath) != DONE:
+            journal.record(logpath, PENDING)
+
+
+def host_index(name, prefix):
+    suffix = name[len(prefix):]
+    return int(suffix) if suffix != "" else 1
+
+
+def partition_testbeds(args, num_testbeds):
+    """
+    Splits the yaml hosts into num_testbeds disjoint testbeds, each with its
+    own server (server, server2, ...) and an equal, contiguous share of the
+    client hosts renumbered from client1. Each testbed is a copy of args with
+    its own hosts section, so no client ever talks to another testbed's server.
+    The demikernel config names the server address the clients connect to,
+    so every server host needs its own config_path in the yaml, e.g.
+    hosts: {server2: {addr: ..., config_path: /path/to/server2.yaml}}.
+    """
+    servers = sorted([name for name in args["hosts"] if name.startswith("server")],
+                     key=lambda name: host_index(name, "server"))
+    clients = sorted([name for name in args["hosts"] if name.startswith("client")],
+                     key=lambda name: host_index(name, "client"))
+    if len(servers) < num_testbeds:
+        debug("Need {} server hosts for {} testbeds, yaml has {}".format(
+            num_testbeds, num_testbeds, len(servers)))
+        exit(1)
+    missing = [name for name in servers[:num_testbeds]
+               if "config_path" not in args["hosts"][name]]
+    if len(missing) > 0:
+        debug("Server hosts {} have no config_path of their own; with one shared "
+              "config every testbed's clients would connect to the same server".format(
+                  ", ".join(missing)))
+        exit(1)
+    per_testbed = len(clients) // num_testbeds
+    testbeds = []
+    for t in range(0, num_testbeds):
+        hosts = {"server": args["hosts"][servers[t]]}
+        for (i, name) in enumerate(clients[t * per_testbed:(t + 1) * per_testbed]):
+            hosts["client{}".format(i + 1)] = args["hosts"][name]
+        testbed = dict(args)
+        testbed["hosts"] = hosts
+        testbed["config_path"] = args["hosts"][servers[t]]["config_path"]
+        testbed["testbed"] = t
+        testbeds.append(testbed)
+    return testbeds
+
+
+def run_points_parallel(args, points):
+    """
+    Runs points concurrently, one worker per testbed pulling from a shared
+    queue. Log paths only depend on the point, so placement does not depend on
+    which testbed ran it. Points needing more client machines than a testbed
+    has run afterwards, one at a time, on the full host set.
+    """
+    testbeds = partition_testbeds(args, args["testbeds"])
+    capacity = num_client_hosts(testbeds[0])
+    pending = queue.Queue()
+    too_big = []
+    for point in points:
+        if point["num_clients"] <= capacity:
+            pending.put(point)
+        else:
+            too_big.append(point)
+    debug("Running {} points on {} testbeds of {} clients, {} on the full pool".format(
+        pending.qsize(), len(testbeds), capacity, len(too_big)))
+
+    def worker(testbed):
+        cleanup(testbed)
+        while True:
+            try:
+                point = pending.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                run_point(testbed, point)
+            except Exception as e:
+                debug("Testbed {} failed on {}: {}".format(
+                    testbed["testbed"], point, e))
+            # failed points go to the back of the queue
+            if requeue(testbed, point):
+                pending.put(point)
+
+    workers = [threading.Thread(target=worker, args=(testbed,))
+               for testbed in testbeds]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    while len(too_big) > 0:
+        point = too_big.pop(0)
+        run_point(args, point)
+        if requeue(args, point):
+            too_big.append(point)
+
+
+def run_points(args, points):
+    queue_points(args, points)
+    if args.get("testbeds", 1) > 1 and not args["pprint"]:
+        run_points_parallel(args, points)
+    else:
+        pending = list(points)
+        while len(pending) > 0:
+            point = pending.pop(0)
+            run_point(args, point)
+            if requeue(args, point):
+                pending.append(point)
+
+
+def parse_point(args, point):
+    """
+    Parses the trial folder of a finished point; returns its result record,
+    or None if the trial failed.
+    """
+    # parse_data imports common, so it can only be imported at call time
+    from parse_data import parse_folder_cached
+    num_clients = point["num_clients"] * point["clients"]
+    final_path = point_log_path(args, point)
+    record, _ = parse_folder_cached(final_path, point["system"],
+                                    str(point["message"]), point["size"],
+                                    point["trial"], num_clients)
+    return record
+
+
+def converged(args, records, needed=0):
+    if len(records) < max(args["min_trials"], needed):
+        return False
+    return all([relative_ci_width([record[metric] for record in records]) <= args["ci_width"]
+                for metric in ["tput", "p99"]])
+
+
+def cycle_exps_adaptive(args):
+    """
+    Runs trials in rounds, parsing each trial as soon as it finishes. A
+    configuration stops being repeated once the 95% confidence intervals of
+    both its throughput and p99 are narrower than ci_width (relative to the
+    mean), after at least min_trials and at most max_trials trials. It also
+    runs at least as many trials as regress.py needs for a change in any one
+    configuration to be significant once all of them are compared.
+    """
+    configs = experiment_points(args, 1)
+    needed = trials_to_reach(DEFAULT_ALPHA, len(configs) * len(DEFAULT_METRICS))
+    if needed > args["max_trials"]:
+        debug("regress.py needs {} trials per configuration to flag changes across {} configurations, but --max_trials is {}".format(
+            needed, len(configs), args["max_trials"]))
+    records = [[] for _ in configs]
+    active = list(range(0, len(configs)))
+    for trial in range(0, args["max_trials"]):
+        if len(active) == 0:
+            break
+        debug("Adaptive round {}: {} configurations still running".format(
+            trial, len(active)))
+        run_points(args, [dict(configs[idx], trial=trial) for idx in active])
+        still_active = []
+        for idx in active:
+            record = parse_point(args, dict(configs[idx], trial=trial))
+            if record is not None:
+                records[idx].append(record)
+            if converged(args, records[idx], needed):
+                debug("Converged after {} trials: system {}, size {}, message {}, clients {}x{}".format(
+                    trial + 1, configs[idx]["system"], configs[idx]["size"],
+                    configs[idx]["message"], configs[idx]["num_clients"],
+                    configs[idx]["clients"]))
+            else:
+                still_active.append(idx)
+        active = still_active
+    total = sum([len(config_records) for config_records in records])
+    debug("Adaptive sweep ran {} trials, fixed sweep would run {}".format(
+        total, len(configs) * args["max_trials"]))
+
+
+def load_ladder(max_machines, max_concurrency):
+    """
+    Coarse (machines, concurrency) levels with roughly doubling offered load:
+    powers of two up to every client machine, then doubling concurrency.
+    """
+    ladder = []
+    machines = 1
+    while machines < max_machines:
+        ladder.append((machines, 1))
+        machines *= 2
+    ladder.append((max_machines, 1))
+    concurrency = 2
+    while concurrency <= max_concurrency:
+        ladder.append((max_machines, concurrency))
+        concurrency *= 2
+    return ladder
+
+
+def split_load(load, max_machines):
+    concurrency = int(math.ceil(load / float(max_machines)))
+    return (load // concurrency, concurrency)
+
+
+def search_saturation(args, config):
+    """
+    Walks up the load ladder until throughput stops rising by more than
+    knee_threshold or p99 exceeds the slo (us), then bisects the offered load
+    between the last good level and the first bad one. Returns the best
+    sustainable level's record, or None if no level was sustainable.
+    Levels are logged under <logfile>/SEARCH_FOLDER, so a search and a
+    regular sweep in the same logfile never reuse each other's trials.
+    """
+    max_machines = num_client_hosts(args)
+    search_args = dict(args, logfile=os.path.join(args["logfile"], SEARCH_FOLDER))
+    measured = {}
+
+    def measure(machines, concurrency):
+        point = dict(config, trial=0, num_clients=machines, clients=concurrency)
+        run_point_until_valid(search_args, point)
+        record = parse_point(search_args, point)
+        if record is not None:
+            record["machines"] = machines
+            record["concurrency"] = concurrency
+            measured[machines * concurrency] = record
+        return record
+
+    def good(record, baseline):
+        if record is None:
+            return False
+        if args["slo"] is not None and record["p99"] > args["slo"]:
+            return False
+        return baseline is None or \
+            record["tput"] >= baseline["tput"] * (1 + args["knee_threshold"])
+
+    lo = None
+    hi = None
+    for (machines, concurrency) in load_ladder(max_machines, args["max_concurrency"]):
+        record = measure(machines, concurrency)
+        if not good(record, lo):
+            hi = machines * concurrency
+            break
+        lo = record
+    if lo is not None and hi is not None:
+        for _ in range(0, args["refine_steps"]):
+            mid = (lo["machines"] * lo["concurrency"] + hi) // 2
+            (machines, concurrency) = split_load(mid, max_machines)
+            if machines * concurrency in measured or \
+                    machines * concurrency <= lo["machines"] * lo["concurrency"]:
+                break
+            record = measure(machines, concurrency)
+            if good(record, lo):
+                lo = record
+            else:
+                hi = machines * concurrency
+
+    sustainable = [record for record in measured.values()
+                   if args["slo"] is None or record["p99"] <= args["slo"]]
+    if len(sustainable) == 0:
+        return None
+    return max(sustainable, key=lambda record: record["tput"])
+
+
+def cycle_exps_search(args):
+    configs = []
+    for point in experiment_points(args, 1):
+        config = {"system": point["system"], "size": point["size"],
+                  "message": point["message"], "placement": point["placement"]}
+        if config not in configs:
+            configs.append(config)
+    outfile = "{}/saturation.csv".format(args["logfile"])
+    os.makedirs(args["logfile"], exist_ok=True)
+    with open(outfile, "w") as f:
+        f.write("system,size,message,num_clients,machines,concurrency,tput,tputgbps,p99,placement\n")
+        for config in configs:
+            best = search_saturation(args, config)
+            if best is None:
+                debug("No sustainable load for system {}, size {}, message {}, {}".format(
+                    config["system"], config["size"], config["message"],
+                    placement_tag(config["placement"])))
+                continue
+            debug("Max sustainable tput for system {}, size {}, message {}, {}: {:.2f} req/ms | {:.2f} Gbps at {}x{} clients, p99 {:.2f} us".format(
+                config["system"], config["size"], config["message"],
+                placement_tag(config["placement"]),
+                best["tput"], best["tputgbps"], best["machines"],
+                best["concurrency"], best["p99"]))
+            f.write("{},{},{},{},{},{},{},{},{},{}\n".format(
+                config["system"], config["size"], config["message"],
+                best["num_clients"], best["machines"], best["concurrency"],
+                best["tput"], best["tputgbps"], best["p99"],
+                placement_tag(config["placement"])))
+            f.flush()
+
+
+def cycle_exps(args):
+    if args.get("search", False) and not args["pprint"]:
+        cycle_exps_search(args)
+    elif args.get("adaptive", False) and not args["pprint"]:
+        cycle_exps_adaptive(args)
+    else:
+        run_points(args, experiment_points(args))
+    report_phase_times()
 
 
 def num_clients_list(num_clients):
@@ -365,9 +981,41 @@ def num_clients_list(num_clients):
         return clients
 
 
+def placements(args):
+    """
+    Server placements to sweep: the given cores (or NUMA node), or with
+    --core_counts the first k of the given cores for each k.
+    """
+    if "server_cores" not in args:
+        return [DEFAULT_PLACEMENT]
+    numa_node = args.numa_node
+    if args.server_cores is not None:
+        cores = parse_cores(args.server_cores)
+    elif numa_node is None:
+        cores = DEFAULT_PLACEMENT["server_cores"]
+    else:
+        cores = None
+    if args.core_counts is None:
+        return [{"server_cores": cores, "numa_node": numa_node}]
+    if cores is None or max(args.core_counts) > len(cores):
+        debug("--core_counts goes up to {} but --server_cores lists {} cores".format(
+            max(args.core_counts), 0 if cores is None else len(cores)))
+        exit(1)
+    return [{"server_cores": cores[:count], "numa_node": numa_node}
+            for count in args.core_counts]
+
+
+def report_journal(journal):
+    counts = journal.counts()
+    debug("Sweep journal: {}".format(", ".join(
+        ["{} {}".format(counts[state], state) for state in sorted(counts)])))
+    for key in journal.failed():
+        debug("Still failed: {}".format(key))
+
+
 def parse_params(args):
     with open(args.yaml) as f:
-        data = yaml.load(f)
+        data = yaml.safe_load(f)
 
     data["libos"] = args.libos  # lwip, rdma, posix
     data["systems"] = args.system  # all of them
@@ -380,7 +1028,33 @@ def parse_params(args):
     data["pprint"] = args.pprint  # just print commands
     data["clients"] = args.clients
     data["perf"] = args.perf
+    data["profile"] = args.profile if "profile" in args else False
+    data["profile_freq"] = args.profile_freq if "profile_freq" in args else DEFAULT_FREQUENCY
+    if data["perf"] and data["profile"]:
+        debug("--perf and --profile both wrap the server in perf; pick one")
+        exit(1)
     data["zero_copy"] = args.zero_copy
+    data["placements"] = placements(args)
+    data["placement"] = data["placements"][0]
+    data["client_cores"] = parse_cores(args.client_cores) \
+        if "client_cores" in args and args.client_cores is not None else None
+    data["testbeds"] = args.testbeds if "testbeds" in args else 1
+    data["telemetry"] = args.telemetry if "telemetry" in args else False
+    data["telemetry_interval"] = args.telemetry_interval \
+        if "telemetry_interval" in args else DEFAULT_INTERVAL
+    data["compact_logs"] = args.compact_logs if "compact_logs" in args else None
+    data["max_attempts"] = args.max_attempts if "max_attempts" in args else DEFAULT_MAX_ATTEMPTS
+    if "search" in args:
+        data["search"] = args.search
+        data["slo"] = args.slo
+        data["knee_threshold"] = args.knee_threshold
+        data["max_concurrency"] = args.max_concurrency
+        data["refine_steps"] = args.refine_steps
+    if "adaptive" in args:
+        data["adaptive"] = args.adaptive
+        data["ci_width"] = args.ci_width
+        data["min_trials"] = args.min_trials
+        data["max_trials"] = args.max_trials
     data["retry"] = True if (not(args.no_retries)) else False
     if data["zero_copy"]:
         assert("baseline" in data["system"])
@@ -407,10 +1081,17 @@ def parse_params(args):
 def main():
     args = parse_args()
     data = parse_params(args)
+    if data["testbeds"] > 1:
+        # exits before anything runs unless every testbed has its own server
+        partition_testbeds(data, data["testbeds"])
     # run cleanup
     if not data["pprint"]:
+        data["journal"] = SweepJournal(data["logfile"])
         cleanup(data)
     cycle_exps(data)
+    if not data["pprint"]:
+        report_journal(data["journal"])
+    close_connections()
 
 
 if __name__ == '__main__':
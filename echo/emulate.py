@@ -0,0 +1,232 @@
+import argparse
+import asyncio
+import os
+import signal
+import stat
+import struct
+import sys
+import time
+"""
+Stand-in dmtr servers and clients for offline runs of the experiment scripts.
+
+They take the flags common.py (and kv/common.py) pass the real binaries and
+write the same logs: the client prints the LATENCY / TAIL LATENCY / retries
+summary lines to stdout and writes one "send_ns latency_ns" line per request
+to --latlog. Client and server talk over TCP on localhost: the client runs -c
+closed-loop connections for -i requests in total, and the server answers
+every request with a -s byte response, assembled from --sgasize segments
+unless --zero-copy is set. The numbers measure a Python TCP echo, not a dmtr
+libOS; they are for exercising and timing the harness.
+
+Usage:
+    python emulate.py install <exec_dir>
+writes {libos}-server, {libos}-client, {libos}-kv-server and {libos}-kv-client
+for every libOS into exec_dir. Then point a yaml at them and at localhost:
+    exec_dir: <exec_dir>
+    kv_exec_dir: <exec_dir>
+    server_ready_marker: "emulated server listening"
+    hosts: {server: {addr: localhost}, client1: {addr: localhost}}
+"""
+LIBOSES = ["dmtr-lwip", "dmtr-rdma", "dmtr-posix"]
+ROLES = {"server": "{}-server", "client": "{}-client",
+         "kv-server": "{}-kv-server", "kv-client": "{}-kv-client"}
+READY_MARKER = "emulated server listening"
+HOST = "127.0.0.1"
+REQUEST_BYTES = 64
+KV_VALUE_BYTES = 1024
+KV_DEFAULT_REQUESTS = 10000
+CONNECT_TIMEOUT = 10  # seconds
+LENGTH = struct.Struct("!I")
+STUB = """#!{python}
+import sys
+sys.path.insert(0, {folder!r})
+import emulate
+emulate.main({role!r})
+"""
+
+
+def parse_args(role, argv):
+    parser = argparse.ArgumentParser(prog=role)
+    parser.add_argument("--port", type=int, required=True)
+    parser.add_argument("--config-path", default=None)
+    parser.add_argument("-s", "--size", type=int,
+                        default=KV_VALUE_BYTES if role.startswith("kv") else 0)
+    parser.add_argument("--system", default=None)
+    parser.add_argument("--message", default=None)
+    parser.add_argument("--sgasize", type=int, default=1)
+    parser.add_argument("--zero-copy", action="store_true")
+    parser.add_argument("--retry", action="store_true")
+    parser.add_argument("-i", "--iterations", type=int, default=None)
+    parser.add_argument("-c", "--clients", type=int, default=1)
+    parser.add_argument("--latlog", default=None)
+    parser.add_argument("--timeout", type=int, default=None)
+    # kv
+    parser.add_argument("--loads", default=None)
+    parser.add_argument("--access", default=None)
+    parser.add_argument("--id", type=int, default=0)
+    # anything else (e.g. a yaml server_cores_flag) is accepted and ignored
+    args, unknown = parser.parse_known_args(argv)
+    if len(unknown) > 0:
+        print("Ignoring flags {}".format(" ".join(unknown)), file=sys.stderr)
+    return args
+
+
+async def read_message(reader):
+    length, = LENGTH.unpack(await reader.readexactly(LENGTH.size))
+    return await reader.readexactly(length)
+
+
+def write_message(writer, payload):
+    writer.write(LENGTH.pack(len(payload)))
+    writer.write(payload)
+
+
+async def serve(args):
+    size = max(args.size, 1)
+    segments = max(args.sgasize, 1)
+    zero_copy = bytes(size)
+    segment_size = max(size // segments, 1)
+    handled = [0]
+
+    async def handle(reader, writer):
+        try:
+            while True:
+                await read_message(reader)
+                if args.zero_copy:
+                    response = zero_copy
+                else:
+                    # one copy per scatter-gather segment, like a serializer
+                    response = b"".join([bytes(segment_size) for _ in range(0, segments)])
+                write_message(writer, response)
+                await writer.drain()
+                handled[0] += 1
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, HOST, args.port, reuse_address=True)
+    print("{} on port {}".format(READY_MARKER, args.port), flush=True)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+    async with server:
+        await stop.wait()
+    print("Handled {} requests".format(handled[0]), flush=True)
+
+
+async def connect(port):
+    deadline = time.time() + CONNECT_TIMEOUT
+    while True:
+        try:
+            return await asyncio.open_connection(HOST, port)
+        except OSError:
+            if time.time() >= deadline:
+                raise
+            await asyncio.sleep(0.05)
+
+
+async def closed_loop(port, requests, samples):
+    reader, writer = await connect(port)
+    request = bytes(REQUEST_BYTES)
+    try:
+        for _ in range(0, requests):
+            send_ns = time.time_ns()
+            start = time.perf_counter_ns()
+            write_message(writer, request)
+            await writer.drain()
+            await read_message(reader)
+            samples.append((send_ns, time.perf_counter_ns() - start))
+    finally:
+        writer.close()
+
+
+def client_requests(args):
+    if args.access is not None:
+        try:
+            with open(args.access) as f:
+                return sum([1 for _ in f])
+        except OSError:
+            print("No access file {}".format(args.access), file=sys.stderr)
+    if args.iterations is not None:
+        return args.iterations
+    return KV_DEFAULT_REQUESTS
+
+
+async def run_clients(args):
+    total = client_requests(args)
+    connections = max(args.clients, 1)
+    samples = []
+    start = time.perf_counter_ns()
+    await asyncio.gather(*[
+        closed_loop(args.port, total // connections +
+                    (1 if idx < total % connections else 0), samples)
+        for idx in range(0, connections)])
+    return samples, time.perf_counter_ns() - start
+
+
+def report(samples, elapsed_ns):
+    latencies = sorted([latency for (_, latency) in samples])
+    if len(latencies) == 0:
+        print("No requests completed", file=sys.stderr)
+        return
+
+    def quantile(q):
+        return latencies[min(int(len(latencies) * q), len(latencies) - 1)]
+
+    print("LATENCY end-to-end: {} ns {} ns/{} ns {} ns ({} samples, {} ms total)".format(
+        latencies[0], sum(latencies) // len(latencies), quantile(0.5),
+        latencies[-1], len(latencies), elapsed_ns // 1000000))
+    print("TAIL LATENCY 99={} ns 99.9={} ns 99.99={} ns".format(
+        quantile(0.99), quantile(0.999), quantile(0.9999)))
+    print("Final num retries: 0", flush=True)
+
+
+def write_latlog(path, samples):
+    with open(path, "w") as f:
+        f.write("".join(["{} {}\n".format(send_ns, latency)
+                         for (send_ns, latency) in samples]))
+
+
+def client(args):
+    try:
+        samples, elapsed = asyncio.run(run_clients(args))
+    except (OSError, asyncio.IncompleteReadError) as e:
+        print("Client failed: {}".format(e), file=sys.stderr)
+        exit(1)
+    if args.latlog is not None:
+        write_latlog(args.latlog, samples)
+    report(samples, elapsed)
+
+
+def install(exec_dir):
+    os.makedirs(exec_dir, exist_ok=True)
+    folder = os.path.dirname(os.path.abspath(__file__))
+    for libos in LIBOSES:
+        for (role, name) in ROLES.items():
+            # the stub keeps the binary's path in the process's command line,
+            # which is what the scripts' pgrep and kill match on
+            path = os.path.join(exec_dir, name.format(libos))
+            with open(path, "w") as f:
+                f.write(STUB.format(python=sys.executable, folder=folder, role=role))
+            os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    print("Installed stand-ins for {} in {}".format(", ".join(LIBOSES), exec_dir))
+
+
+def main(role=None):
+    if role is None:
+        if len(sys.argv) != 3 or sys.argv[1] != "install":
+            print("Usage: python emulate.py install <exec_dir>", file=sys.stderr)
+            exit(1)
+        install(sys.argv[2])
+        return
+    args = parse_args(role, sys.argv[1:])
+    if role.endswith("server"):
+        asyncio.run(serve(args))
+    else:
+        client(args)
+
+
+if __name__ == '__main__':
+    main()
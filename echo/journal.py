@@ -0,0 +1,89 @@
+import json
+import os
+import threading
+import time
+"""
+Persistent journal of a sweep's experiment points.
+
+Every state change of a point (PENDING, RUNNING, DONE, FAILED) is appended as
+one JSON line to <logfile>/sweep_journal.jsonl and flushed to disk, so the
+journal survives a crash or an interrupt at any point; a half-written last
+line is ignored on load. Points are keyed by their trial folder relative to
+the logfile. On restart, run_tput_exp skips points the journal has as DONE
+without looking at their logs, and validates everything else: a folder left
+by a crashed or failed run is moved under REQUEUED and the point is run
+again.
+"""
+JOURNAL = "sweep_journal.jsonl"
+REQUEUED = "requeued"
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+DEFAULT_MAX_ATTEMPTS = 3
+
+
+class SweepJournal(object):
+    def __init__(self, logfile):
+        self.logfile = logfile
+        self.path = os.path.join(logfile, JOURNAL)
+        self.lock = threading.Lock()
+        self.states = {}
+        # runs of each point by this process, for the re-queue limit
+        self.attempts = {}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.states[entry["key"]] = entry
+
+    def key(self, logpath):
+        return os.path.relpath(logpath, self.logfile)
+
+    def state(self, logpath):
+        entry = self.states.get(self.key(logpath))
+        return None if entry is None else entry["state"]
+
+    def record(self, logpath, state, **info):
+        entry = dict(info, key=self.key(logpath), state=state, time=time.time())
+        with self.lock:
+            if state == RUNNING:
+                self.attempts[entry["key"]] = self.attempts.get(entry["key"], 0) + 1
+            self.states[entry["key"]] = entry
+            os.makedirs(self.logfile, exist_ok=True)
+            with open(self.path, "a") as f:
+                f.write(json.dumps(entry) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def attempts_of(self, logpath):
+        with self.lock:
+            return self.attempts.get(self.key(logpath), 0)
+
+    def counts(self):
+        counts = {}
+        for entry in self.states.values():
+            counts[entry["state"]] = counts.get(entry["state"], 0) + 1
+        return counts
+
+    def failed(self):
+        return sorted([key for (key, entry) in self.states.items()
+                       if entry["state"] == FAILED])
+
+
+def requeue_folder(logfile, logpath):
+    """
+    Moves an invalid trial folder to <logfile>/REQUEUED/<key>.<n>, keeping
+    it for inspection and out of the way of the rerun and of walk_trials.
+    """
+    key = os.path.relpath(logpath, logfile)
+    n = 0
+    while os.path.exists(os.path.join(logfile, REQUEUED, "{}.{}".format(key, n))):
+        n += 1
+    target = os.path.join(logfile, REQUEUED, "{}.{}".format(key, n))
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    os.rename(logpath, target)
+    return target
@@ -1,23 +1,52 @@
 import os
 from pathlib import Path
 import re
-import sys
 import argparse
+import json
 import parse
-from common import MESSAGES, SIZES, BASE_SIZE, debug, num_clients_list
-import heapq
-import math
-import multiprocessing as mp
-from statistics import mean
+from common import EXPERIMENT_RESULT, debug, num_clients_list
+import numpy as np
+from harness.histogram import LatencyHistogram
+from harness.latlog import read_any_log
+from perf_stat import PERF_FIELDS, parse_perf_stat, per_request_metrics
+from timeseries import steady_state_bounds, window_stats
+from results_db import open_db, upsert_records
+from harness.analysis import STRIP_PERCENT, size_from_name, walk_trials, parse_trials, trial_jobs
+from placement import exp_fields, tag_cores
+from telemetry import TELEMETRY_FIELDS, trial_fields
 MAX_CLIENTS = 10
-STRIP_PERCENT = .03
+CSV_FIELDS = ["system", "size", "message", "num_clients", "median", "avg",
+              "p99", "tput", "tputgbps", "retries", "p999", "p9999",
+              "tput_source", "tput_littles"] + PERF_FIELDS + \
+             ["profile_freq", "placement", "server_cores"] + TELEMETRY_FIELDS
+PARSE_CACHE = ".parse_cache.json"
+PARSE_CACHE_VERSION = 8
+TPUT_INTERVAL_NS = 100 * 1000000
+TPUT_INTERVALS = "tput_intervals.csv"
+SERIES = "series.csv"
+LAYOUT = [("system", str), ("message", str), ("size", size_from_name),
+          (("num_clients", "placement"), exp_fields)]
 
+def quantile_index(arr, quantile):
+    return min(int(len(arr) * quantile), len(arr) - 1)
 def mean_func(arr):
-    return mean(arr)
+    return float(np.mean(arr))
 def median_func(arr):
-    return arr[int(len(arr) * 0.50)]
+    idx = quantile_index(arr, 0.50)
+    return np.partition(arr, idx)[idx]
 def p99_func(arr):
-    return arr[int(len(arr) * 0.99)]
+    idx = quantile_index(arr, 0.99)
+    return np.partition(arr, idx)[idx]
+
+def summarize_latencies(arr):
+    """
+    Returns (median, p99, avg) in ns, with a single partition pass instead of
+    sorting the full sample array.
+    """
+    median_idx = quantile_index(arr, 0.50)
+    p99_idx = quantile_index(arr, 0.99)
+    partitioned = np.partition(arr, [median_idx, p99_idx])
+    return partitioned[median_idx], partitioned[p99_idx], mean_func(arr)
 
 def convert_tput(tput, size):
     return tput * 1000 * size * 8 / 1000000000
@@ -66,7 +95,23 @@ def parse_args():
                         action = 'store_true')
     parser.add_argument("-o", "--outfile",
                         help = "Base outfile",
-                        required = True)
+                        default = None)
+    parser.add_argument("-db", "--db",
+                        help = "SQLite results database to upsert trials into",
+                        default = None)
+    parser.add_argument("-ag", "--aggregate",
+                        help = "Also write quantiles merged across trials to this file",
+                        default = None)
+    parser.add_argument("-nc", "--no_cache",
+                        help = "Ignore and do not write per-trial parse caches",
+                        action = "store_true")
+    parser.add_argument("-t", "--trim",
+                        help = "Drop a fixed STRIP_PERCENT from each end of every log, or cut at the detected steady state",
+                        choices = ["fixed", "steady"],
+                        default = "fixed")
+    parser.add_argument("-ser", "--series",
+                        help = "Write each trial's windowed latency/tput series to series.csv",
+                        action = "store_true")
     parser.add_argument("-sys", "--systems",
                         help = "Only parse these systems",
                         nargs = "+",
@@ -130,116 +175,382 @@ def parse_log(logfile):
     return latency
 
 
-def parse_folder(final_path, system, message, size, trial, num_clients):
+def read_experiment(final_path):
+    """
+    The trial's EXPERIMENT_RESULT written by run_tput_exp, or None for older
+    trials.
+    """
+    experiment_file = Path(final_path) / EXPERIMENT_RESULT
+    if os.path.exists(experiment_file):
+        try:
+            with open(experiment_file) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            pass
+    return None
+
+def client_machines(final_path, num_clients):
+    """
+    Number of client machines a trial used. Newer trials record it in their
+    experiment result; older ones are matched against num_clients_list.
+    """
+    experiment = read_experiment(final_path)
+    if experiment is not None and "clients" in experiment:
+        return len(experiment["clients"])
+    clients_list  = num_clients_list(num_clients)
+    for (machines, concurrent) in clients_list:
+        if machines * concurrent == num_clients:
+            break
+    return machines
+
+def parse_folder(final_path, system, message, size, trial, num_clients,
+                 trim="fixed", series=False):
+    """
+    Parses one trial folder into a result record (see CSV_FIELDS) and the
+    merged latency histogram of all its clients. Returns (None, None) if the
+    trial is missing or incomplete. trim is passed to parse_latency_log; with
+    series, the per-client windowed series are written to SERIES.
+    """
     tputs = []
     p99s = []
     medians = []
     avgs = []
     all_retries = 0
-    complete_latencies = []
+    trial_hist = LatencyHistogram()
+    measured_tput = 0.0
+    intervals = np.zeros(0, dtype=np.int64)
+    timestamped = True
+    requests = 0
+    client_series = []
     use_logged_latencies = True
     debug("Parsing folder {}", final_path)
-    clients_list  = num_clients_list(num_clients)
-    for (machines, concurrent) in clients_list:
-        if machines * concurrent == num_clients:
-            break
-    for i in range(1, min(machines + 1, MAX_CLIENTS + 1)):
+    machines = client_machines(final_path, num_clients)
+    for i in range(1, machines + 1):
         client_err = "{}/client{}.err.log".format(final_path, i)
         client_log = "{}/client{}.log".format(final_path, i)
         latencies_log = "{}/client{}.latencies.log".format(final_path, i)
         if not(os.path.exists(final_path)):
             debug("Path {} does not exist".format(final_path))
-            return ""
+            return None, None
         retries = parse_log(client_log)
-        latency_list = parse_latencies(latencies_log)
-        complete_latencies.append(latency_list) # to eventually sort them all
+        if series:
+            # the log is read and its bounds found once for the series and
+            # the trimmed samples
+            raw_latencies, raw_send_times, total = parse_latency_log(latencies_log, None)
+            start, end = trim_bounds(raw_latencies, trim)
+            client_series.append((i, window_stats(raw_latencies, raw_send_times),
+                                  start, end))
+            latencies = raw_latencies[start:end]
+            send_times = None if raw_send_times is None else raw_send_times[start:end]
+        else:
+            latencies, send_times, total = parse_latency_log(latencies_log, trim)
+        trial_hist.record(latencies)
+        requests += total
+        if send_times is not None:
+            client_tput, client_intervals = measured_throughput(latencies, send_times)
+            measured_tput += client_tput
+            if len(client_intervals) > len(intervals):
+                client_intervals[:len(intervals)] += intervals
+                intervals = client_intervals
+            else:
+                intervals[:len(client_intervals)] += client_intervals
+        else:
+            timestamped = False
         
         if len(retries) != 0:
             all_retries += int(retries["retries"])
-        if len(latency_list) == 0:
+        if len(latencies) == 0:
             debug("Path {} has an error".format(final_path))
-            return ""
-
-    # take advantage of the fact that they're already sorted to make this faster
-    sorted_latencies = list(heapq.merge(*complete_latencies))
-    median = median_func(sorted_latencies) / float(1000)
-    p99 = p99_func(sorted_latencies) / float(1000)
-    avg = mean_func(sorted_latencies) / float(1000)
-    tput = 1.0 * num_clients / avg * 1000
+            return None, None
+
+    if len(trial_hist) == 0:
+        debug("Path {} has no client results".format(final_path))
+        return None, None
+    if series:
+        write_series(final_path, client_series)
+    summary = trial_hist.summary()
+    median = summary["median"] / float(1000)
+    p99 = summary["p99"] / float(1000)
+    avg = summary["avg"] / float(1000)
+    # Little's law only holds for a perfectly closed loop, so it is just the
+    # fallback for logs without send timestamps
+    tput_littles = 1.0 * num_clients / avg * 1000
+    if timestamped:
+        tput = measured_tput
+        tput_source = "measured"
+        write_intervals(final_path, intervals)
+    else:
+        tput = tput_littles
+        tput_source = "littles_law"
     tput_converted = convert_tput(tput, size)
     
-    return "{},{},{},{},{},{},{},{},{},{}\n".format(
-            system,size,message,num_clients,median,avg*1000,p99,tput,
-            tput_converted,
-            all_retries)
+    record = {"system": system, "size": size, "message": message,
+              "num_clients": num_clients, "trial": trial,
+              "median": median, "avg": avg * 1000, "p99": p99,
+              "tput": tput, "tputgbps": tput_converted,
+              "retries": all_retries,
+              "p999": summary["p999"] / float(1000),
+              "p9999": summary["p9999"] / float(1000),
+              "tput_source": tput_source,
+              "tput_littles": tput_littles}
+    record.update(server_perf_metrics(final_path, requests))
+    # profiled runs are slower; keep them apart from clean ones
+    experiment = read_experiment(final_path)
+    record["profile_freq"] = None
+    if experiment is not None and experiment.get("profile") is not None:
+        record["profile_freq"] = experiment["profile"]["frequency"]
+    # the clients folder name carries the server placement
+    _, record["placement"] = exp_fields(Path(final_path).parent.name)
+    record["server_cores"] = tag_cores(record["placement"])
+    window = None
+    telemetry = {}
+    if experiment is not None:
+        if "clients_end_ns" in experiment:
+            window = (experiment["clients_start_ns"], experiment["clients_end_ns"])
+        telemetry = experiment.get("telemetry") or {}
+    record.update(trial_fields(final_path, window, telemetry.get("clock_offsets"),
+                               telemetry.get("libos")))
+    return record, trial_hist
 
-def parse_latencies(log):
+def server_perf_metrics(final_path, requests):
+    """
+    Per-request server counters from a --perf run's server.err.log, over every
+    request the clients logged (the counters cover the whole run, so the
+    log is not trimmed here). All None for runs without perf.
+    """
+    server_err = "{}/server.err.log".format(final_path)
+    counters = {}
+    if os.path.exists(server_err):
+        counters = parse_perf_stat(server_err)
+    return per_request_metrics(counters, requests)
+
+def format_row(record):
+    return ",".join(["NA" if record[field] is None else str(record[field])
+                     for field in CSV_FIELDS]) + "\n"
+
+def folder_fingerprint(final_path):
+    """
+    (size, mtime) of every log in a trial folder; a trial is re-parsed only
+    when this changes.
+    """
+    fingerprint = {}
+    if not(os.path.isdir(final_path)):
+        return fingerprint
+    for name in sorted(os.listdir(final_path)):
+        # skip the files the parser itself writes
+        if name.startswith(PARSE_CACHE) or name in [TPUT_INTERVALS, SERIES]:
+            continue
+        stat = os.stat(Path(final_path) / name)
+        fingerprint[name] = [stat.st_size, stat.st_mtime_ns]
+    return fingerprint
+
+def read_parse_cache(final_path, fingerprint):
+    cache_file = Path(final_path) / PARSE_CACHE
+    if not(os.path.exists(cache_file)):
+        return None
+    try:
+        with open(cache_file) as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if cached.get("version") != PARSE_CACHE_VERSION or \
+            cached.get("fingerprint") != fingerprint:
+        return None
+    return cached["record"], LatencyHistogram.from_dict(cached["histogram"])
+
+def write_parse_cache(final_path, fingerprint, record, hist):
+    cache_file = Path(final_path) / PARSE_CACHE
+    tmp_file = Path(final_path) / "{}.tmp".format(PARSE_CACHE)
+    cached = {"version": PARSE_CACHE_VERSION,
+              "fingerprint": fingerprint,
+              "record": record,
+              "histogram": hist.to_dict()}
+    try:
+        with open(tmp_file, "w") as f:
+            json.dump(cached, f)
+        os.replace(tmp_file, cache_file)
+    except OSError:
+        debug("Could not write parse cache in {}".format(final_path))
+
+def parse_folder_cached(final_path, system, message, size, trial, num_clients,
+                        use_cache=True, trim="fixed", series=False):
+    """
+    parse_folder, but reuses the result stored in the trial folder's
+    PARSE_CACHE when none of the trial's logs have changed since it was
+    written.
+    """
+    fingerprint = folder_fingerprint(final_path)
+    # the cached result is only valid for the same trimming
+    fingerprint["trim"] = trim
+    if use_cache and not series:
+        cached = read_parse_cache(final_path, fingerprint)
+        if cached is not None:
+            return cached
+    record, hist = parse_folder(final_path, system, message, size, trial,
+                                num_clients, trim, series)
+    if record is not None and use_cache:
+        write_parse_cache(final_path, fingerprint, record, hist)
+    return record, hist
+
+def trim_bounds(values, trim="fixed"):
+    """
+    The [start, end) range of samples kept by parse_latency_log's trim.
+    """
+    if trim == "steady":
+        return steady_state_bounds(values)
+    elif trim == "fixed":
+        return int(len(values) * STRIP_PERCENT), int(len(values) * (1.0 - STRIP_PERCENT))
+    return 0, len(values)
+
+def parse_latency_log(log, trim="fixed"):
+    """
+    Loads a clientN.latencies.log into int64 arrays, with warm-up/cool-down
+    samples trimmed: STRIP_PERCENT from each end for trim="fixed", or the
+    range before/after the detected steady state for trim="steady". Pass
+    trim=None for the raw log. Each line is either a
+    latency in ns, or a send timestamp and a latency in ns; binary logs
+    written by harness/latlog.py are read as well. Returns
+    (latencies, send_times, total); send_times is None for latency-only
+    logs, and total is the number of samples in the log before trimming.
+    The arrays are left in log order; use summarize_latencies or the *_func
+    helpers rather than indexing into them.
+    """
     if not (os.path.exists(log)):
         debug("Path {} does not exist".format(log))
-        return []
-    with open(log) as f:
-        raw_lines = f.readlines()
-        lines = [int(line.strip()) for line in raw_lines]
-    front_cutoff = int(len(lines) * STRIP_PERCENT)
-    end_cutoff = int(len(lines) * (1.0 - STRIP_PERCENT))
-    lines = lines[front_cutoff:end_cutoff]
-    return sorted(lines)
+        return np.empty(0, dtype=np.int64), None, 0
+    values, send_times = read_any_log(log)
+    front_cutoff, end_cutoff = trim_bounds(values, trim)
+    if send_times is not None:
+        send_times = send_times[front_cutoff:end_cutoff]
+    return values[front_cutoff:end_cutoff], send_times, len(values)
 
+def parse_latencies(log):
+    latencies, _, _ = parse_latency_log(log)
+    return latencies
 
-def get_suffix(arg):
+def write_series(final_path, series):
+    """
+    Writes the windowed series of every client in a trial to SERIES in the
+    trial folder (latencies in us, tput in req/ms), with the windows kept
+    after steady-state detection flagged.
+    """
     try:
-        return arg.split("_")[1]
-    except:
-        print(arg)
-        exit(1)
+        with open(Path(final_path) / SERIES, "w") as f:
+            f.write("client,window,start_sample,median,p99,avg,tput,steady\n")
+            for (client, stats, start, end) in series:
+                for idx in range(0, len(stats["median"])):
+                    window_start = stats["start"][idx]
+                    steady = window_start >= start and \
+                        window_start + stats["window"] <= end
+                    tput = "" if stats["tput"] is None else stats["tput"][idx]
+                    f.write("{},{},{},{},{},{},{},{}\n".format(
+                        client, idx, window_start,
+                        stats["median"][idx] / float(1000),
+                        stats["p99"][idx] / float(1000),
+                        stats["mean"][idx] / float(1000),
+                        tput, int(steady)))
+    except OSError:
+        debug("Could not write {} in {}".format(SERIES, final_path))
 
-def iterate(f, args):
-    pool = mp.Pool(mp.cpu_count())
-    pool_args = []
-    current_path = Path(args.logfile)
-    for system_name in os.listdir(args.logfile):
-        if not(os.path.isdir(current_path / system_name)) or system_name == "plots":
-            continue # extra files stored in directory
-        if (len(args.systems) > 0 and system_name not in args.systems):
-            debug("Skipping {}".format(system_name))
-            continue
-        for message in os.listdir(current_path / system_name):
-            for size_name in os.listdir(current_path / system_name / message):
-                size = int(get_suffix(size_name))
-                if (len(args.sizes) > 0 and size not in args.sizes):
-                    debug("Skipping system {} message {} size {}".format(system_name, message, size))
-                    continue
-                for clients_name in os.listdir(current_path / system_name / message / size_name):
-                    num_clients = get_clients(clients_name)
-                    if (len(args.num_clients) > 0 and num_clients not in args.num_clients):
-                        debug("Skipping {}".format(num_clients))
-                        continue
-                    for trial_name in os.listdir((current_path / system_name / message / size_name / clients_name)):                    
-                        trial = int(get_suffix(trial_name))
-                        final_path = ( current_path / system_name / message / size_name / clients_name / trial_name)
-                        pool_args.append([final_path, system_name, message,
-                            size, trial, num_clients])
-                            
-    ret = pool.starmap(parse_folder, pool_args)
-    for line in ret:
-        if line != "":
-            f.write(line)
+def measured_throughput(latencies, send_times, interval_ns=TPUT_INTERVAL_NS):
+    """
+    Achieved throughput of one client in req/ms: completed requests over the
+    span from its first send to its last completion. Also returns the number
+    of completions in each interval_ns-long interval of that span. Both only
+    use the client's own clock, so clients need not be clock-synchronized.
+    """
+    if len(latencies) == 0:
+        return 0.0, np.zeros(0, dtype=np.int64)
+    completions = send_times + latencies
+    start = int(np.min(send_times))
+    duration = int(np.max(completions)) - start
+    if duration <= 0:
+        return 0.0, np.zeros(0, dtype=np.int64)
+    intervals = np.bincount((completions - start) // interval_ns)
+    return len(latencies) / (duration / float(1000000)), intervals
+
+def write_intervals(final_path, intervals, interval_ns=TPUT_INTERVAL_NS):
+    """
+    Writes the per-interval throughput (req/ms) of a trial, summed over its
+    clients, to TPUT_INTERVALS in the trial folder.
+    """
+    interval_ms = interval_ns / float(1000000)
+    try:
+        with open(Path(final_path) / TPUT_INTERVALS, "w") as f:
+            f.write("start_ms,tput\n")
+            for (idx, count) in enumerate(intervals):
+                f.write("{},{}\n".format(idx * interval_ms, count / interval_ms))
+    except OSError:
+        debug("Could not write {} in {}".format(TPUT_INTERVALS, final_path))
+
+
+def iterate(f, args, db=None):
+    trials = walk_trials(args.logfile, LAYOUT,
+                         {"system": args.systems, "size": args.sizes,
+                          "num_clients": args.num_clients})
+    ret = parse_trials(parse_folder_cached, trial_jobs(
+        trials, ["system", "message", "size", "trial", "num_clients"],
+        not(args.no_cache), args.trim, args.series))
+    if db is not None:
+        upsert_records(db, [record for (record, _) in ret if record is not None])
+    aggregated = {}
+    for (record, hist) in ret:
+        if record is not None:
+            if f is not None:
+                f.write(format_row(record))
+            key = (record["system"], record["message"], record["size"],
+                    record["num_clients"], record["placement"])
+            if key not in aggregated:
+                aggregated[key] = [0, LatencyHistogram()]
+            aggregated[key][0] += 1
+            aggregated[key][1] += hist
+    return aggregated
+
+def write_aggregate(outfile, aggregated):
+    """
+    Writes one row per (system, message, size, num_clients, placement) with
+    quantiles taken over the merged histogram of every trial.
+    """
+    with open(outfile, "w") as f:
+        f.write("system,size,message,num_clients,trials,median,avg,p99,p999,p9999,placement\n")
+        for (system, message, size, num_clients, placement) in sorted(aggregated):
+            trials, hist = aggregated[(system, message, size, num_clients, placement)]
+            summary = hist.summary()
+            f.write("{},{},{},{},{},{},{},{},{},{},{}\n".format(
+                system, size, message, num_clients, trials,
+                summary["median"] / float(1000),
+                summary["avg"] / float(1000),
+                summary["p99"] / float(1000),
+                summary["p999"] / float(1000),
+                summary["p9999"] / float(1000),
+                placement))
                         
-def get_clients(name):
-    return int(name.replace("clients", ""))
 def main():
     args = parse_args()
-    outfile = "{}".format(args.outfile)
-    if not (args.append):
-        f =  open(outfile, "w")
-    else:
-        f = open(outfile, "a")
-    f.write("system,size,message,num_clients,median,avg,p99,tput,tputgbps,retries\n")
+    if args.outfile is None and args.db is None:
+        debug("Need at least one of --outfile or --db")
+        exit(1)
+    f = None
+    if args.outfile is not None:
+        outfile = "{}".format(args.outfile)
+        if not (args.append):
+            f =  open(outfile, "w")
+        else:
+            f = open(outfile, "a")
+        f.write("{}\n".format(",".join(CSV_FIELDS)))
+    db = None
+    if args.db is not None:
+        db = open_db(args.db)
     #size_graph(f, args)
     #depth_graph(f, args)
-    iterate(f, args)
-    f.flush()
-    f.close()
+    aggregated = iterate(f, args, db)
+    if f is not None:
+        f.flush()
+        f.close()
+    if db is not None:
+        db.close()
+    if args.aggregate is not None:
+        write_aggregate(args.aggregate, aggregated)
     
 if __name__ == '__main__':
     main()
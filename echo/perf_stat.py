@@ -0,0 +1,80 @@
+import re
+"""
+Parses the `perf stat` counters that --perf runs leave at the end of
+server.err.log and normalizes them per request.
+
+perf prints one line per event, e.g.
+     3,456,789,012      cycles          #    2.800 GHz
+        1,234.56 msec task-clock        #    0.999 CPUs utilized
+   <not supported>      dTLB-prefetch-misses
+When there are more events than hardware counters, perf multiplexes them
+and ends each line with the share of the run the event was counted for:
+         1,234,567      LLC-load-misses                        (66.67%)
+     <not counted>      LLC-stores                             (0.00%)
+perf has already scaled such counts up by time enabled / time running, so
+they are taken as they are; an event counted for none of the run is None.
+The server's own stderr shares the file, so only lines that look like
+counters are picked up.
+"""
+PERF_EVENTS = ["task-clock", "cycles", "instructions", "cache-references",
+               "cache-misses", "L1-dcache-loads", "L1-dcache-load-misses",
+               "L1-dcache-stores", "dTLB-loads", "dTLB-load-misses",
+               "dTLB-prefetch-misses", "LLC-loads", "LLC-load-misses",
+               "LLC-stores", "LLC-prefetch"]
+# per-request metric -> event counted
+PER_REQUEST = {"cycles_per_req": "cycles",
+               "instructions_per_req": "instructions",
+               "llc_misses_per_req": "LLC-load-misses",
+               "dtlb_misses_per_req": "dTLB-load-misses"}
+PERF_FIELDS = list(PER_REQUEST) + ["ipc"]
+COUNTER_LINE = re.compile(
+    r"^\s*([\d,.]+|<not supported>|<not counted>)\s+(?:msec\s+)?([\w.-]+)(?::\w+)?\s*"
+    r"(?:#.*?)?(?:\((\d+(?:\.\d+)?)%\))?\s*$")
+
+
+def perf_events_arg():
+    return ",".join(PERF_EVENTS)
+
+
+def parse_perf_stat(logfile):
+    """
+    Returns {event: count} for every event perf reported in logfile; events
+    perf could not count map to None. Empty if the run was not under perf.
+    """
+    counters = {}
+    in_stats = False
+    with open(logfile, "r", errors="replace") as f:
+        for line in f:
+            if "Performance counter stats" in line:
+                # only the last perf stat block counts
+                counters = {}
+                in_stats = True
+                continue
+            if not in_stats:
+                continue
+            match = COUNTER_LINE.match(line)
+            if match is None or match.group(2) not in PERF_EVENTS:
+                continue
+            value = match.group(1)
+            running = match.group(3)
+            if value.startswith("<") or (running is not None and float(running) == 0):
+                counters[match.group(2)] = None
+            else:
+                counters[match.group(2)] = float(value.replace(",", ""))
+    return counters
+
+
+def per_request_metrics(counters, requests):
+    """
+    Normalizes counters by the number of requests the server handled.
+    Metrics whose events were not counted are None.
+    """
+    metrics = {field: None for field in PERF_FIELDS}
+    if requests <= 0:
+        return metrics
+    for (field, event) in PER_REQUEST.items():
+        if counters.get(event) is not None:
+            metrics[field] = counters[event] / float(requests)
+    if counters.get("cycles") and counters.get("instructions") is not None:
+        metrics["ipc"] = counters["instructions"] / counters["cycles"]
+    return metrics
@@ -0,0 +1,71 @@
+"""
+Server core placement: which cores (or NUMA node) the server is pinned to.
+
+A placement is a dict {"server_cores": [int] or None, "numa_node": int or
+None}. Its tag, e.g. "cores0-3" or "numa1_cores8-11", names it in results and
+is appended to a trial's clients folder ("8clients_cores0-3"). The default
+placement, the old hard-coded `taskset 0x1`, keeps the plain folder name so
+existing log trees still parse.
+"""
+DEFAULT_PLACEMENT = {"server_cores": [0], "numa_node": None}
+DEFAULT_TAG = "cores0"
+
+
+def parse_cores(spec):
+    """
+    "0-3,8" -> [0, 1, 2, 3, 8]
+    """
+    cores = []
+    for part in str(spec).split(","):
+        if "-" in part:
+            first, last = part.split("-")
+            cores.extend(range(int(first), int(last) + 1))
+        elif part != "":
+            cores.append(int(part))
+    return cores
+
+
+def format_cores(cores):
+    """
+    [0, 1, 2, 3, 8] -> "0-3,8", the inverse of parse_cores.
+    """
+    ranges = []
+    for core in cores:
+        if len(ranges) > 0 and core == ranges[-1][1] + 1:
+            ranges[-1][1] = core
+        else:
+            ranges.append([core, core])
+    return ",".join([str(first) if first == last else "{}-{}".format(first, last)
+                     for (first, last) in ranges])
+
+
+def placement_tag(placement):
+    parts = []
+    if placement.get("numa_node") is not None:
+        parts.append("numa{}".format(placement["numa_node"]))
+    if placement.get("server_cores"):
+        parts.append("cores{}".format(format_cores(placement["server_cores"])))
+    return "_".join(parts)
+
+
+def tag_cores(tag):
+    """
+    Number of server cores named by a tag, or None if it only names a node.
+    """
+    for part in tag.split("_"):
+        if part.startswith("cores"):
+            return len(parse_cores(part[len("cores"):]))
+    return None
+
+
+def exp_suffix(placement):
+    tag = placement_tag(placement)
+    return "" if tag == DEFAULT_TAG else "_{}".format(tag)
+
+
+def exp_fields(name):
+    """
+    "8clients_cores0-3" -> (8, "cores0-3"); "8clients" -> (8, DEFAULT_TAG)
+    """
+    count, _, tag = name.partition("clients")
+    return int(count), (tag.lstrip("_") or DEFAULT_TAG)
@@ -1,67 +1,172 @@
 import sys
 import os
 import argparse
+import hashlib
+import json
 from pathlib import Path
-from parse_data import get_suffix
+from parse_data import CSV_FIELDS, LAYOUT
+from results_db import open_db, export_csv, distinct_sizes, query
 import subprocess as sh
 from common import debug
+from harness.analysis import walk_trials
+PLOT_CACHE = ".plot_cache.json"
 
 def get_sizes(folder):
-    sizes = []
-    current_path = Path(folder)
-    for system_name in os.listdir(folder):
-        if not(os.path.isdir(current_path / system_name)) or system_name == "plots":
-            continue
-        for message in os.listdir(current_path / system_name):
-            for size_name in os.listdir(current_path / system_name / message):
-                size = int(get_suffix(size_name))
-                if size not in sizes:
-                    sizes.append(size)
-    return sorted(sizes)
-    
+    # the same walk as parse_data, so plots, requeued trials and search
+    # levels are skipped the same way
+    return sorted(set([trial["size"] for trial in walk_trials(folder, LAYOUT)]))
 
 
 def parse_args():
     parser = argparse.ArgumentParser()
     parser.add_argument("-f", "--folder", help = "Base folder", required = True)
     parser.add_argument("-m", "--message", help = "Workload message", default = "None")
+    parser.add_argument("-db", "--db", help = "Read results from this SQLite database instead of log.log", default = None)
+    parser.add_argument("-fr", "--force", help = "Re-render every figure, even if its inputs are unchanged", action = "store_true")
+    parser.add_argument("-b", "--backend", help = "Render with matplotlib in parallel, or with plot.R", choices = ["python", "r"], default = "python")
     return parser.parse_args()
 
 def run(args):
     try:
         sh.check_call(args)
         debug("SUCCESS: ran {}".format(args))
+        return True
     except:
         debug("FAILED: to run {}".format(args))
+        return False
+
+class PlotCache(object):
+    """
+    Fingerprint of the inputs each figure in out_folder was last drawn from,
+    so figures whose data slice and parameters are unchanged are skipped.
+    """
+    def __init__(self, out_folder, force=False):
+        self.path = Path(out_folder) / PLOT_CACHE
+        self.force = force
+        self.entries = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path) as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError):
+                self.entries = {}
+
+    def fresh(self, outfile, fingerprint):
+        return not self.force and os.path.exists(outfile) and \
+            self.entries.get(os.path.basename(str(outfile))) == fingerprint
+
+    def record(self, outfile, fingerprint):
+        self.entries[os.path.basename(str(outfile))] = fingerprint
+
+    def save(self):
+        tmp_file = "{}.tmp".format(self.path)
+        with open(tmp_file, "w") as f:
+            json.dump(self.entries, f, indent=2, sort_keys=True)
+        os.replace(tmp_file, self.path)
+
+def digest(*parts):
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(part if isinstance(part, bytes) else str(part).encode())
+        h.update(b"\0")
+    return h.hexdigest()
+
+def file_digest(path, size=None):
+    """
+    Digest of a results CSV, or only of its header and the rows for size.
+    """
+    with open(path, "rb") as f:
+        lines = f.readlines()
+    if size is not None and len(lines) > 0:
+        column = lines[0].decode().strip().split(",").index("size")
+        lines = lines[:1] + [line for line in lines[1:]
+                             if line.decode().split(",")[column] == str(size)]
+    return digest(*lines)
+
+def source_digest(name):
+    with open(Path(__file__).resolve().parent / name, "rb") as f:
+        return digest(f.read())
+
+def run_cached(cache, args, outfile, inputs):
+    fingerprint = digest(source_digest("plot.R"), inputs,
+                         *[arg for arg in args if arg != str(outfile)])
+    if cache.fresh(outfile, fingerprint):
+        debug("Unchanged: {}".format(outfile))
+        return
+    if run(args):
+        cache.record(outfile, fingerprint)
         
 
-def iterate_plot(out_folder, logfile, sizes, message):
+def iterate_plot(out_folder, logfile, sizes, message, db=None, force=False):
+    cache = PlotCache(out_folder, force)
+    full_digest = file_digest(logfile)
     # full plot in req and gbps
-    base_args = ["./plot.R", str(logfile)]
-    
-    rqs_args = ["./plot.R", str(logfile)]
     rqs_file = "{}/size.pdf".format(out_folder)
-    rqs_args.extend([rqs_file, "size"])
-    run(rqs_args)
+    run_cached(cache, ["./plot.R", str(logfile), rqs_file, "size"],
+               rqs_file, full_digest)
     debug("Finished req/s plot")
 
-    gbps_args = ["./plot.R", str(logfile)]
     gbps_file = "{}/size_gbps.pdf".format(out_folder)
-    gbps_args.extend([gbps_file, "full"])
-    run(gbps_args)
+    run_cached(cache, ["./plot.R", str(logfile), gbps_file, "full"],
+               gbps_file, full_digest)
     debug("Finished gbps plot")
 
     for size in sizes:
+        size_logfile = logfile
+        if db is not None:
+            # facets only need this size's rows
+            size_logfile = "{}/results_size_{}.csv".format(out_folder, size)
+            export_csv(db, size_logfile, CSV_FIELDS, size=size)
+        # a facet only depends on the rows of its size
+        size_digest = file_digest(size_logfile, size)
         for mmt in ["mp99", "mavg", "avgmedian"]:
             mmt_name = "p99"
             if "mavg" in mmt:
                 mmt_name = "avg"
             elif "median" in mmt:
                 mmt_name = "median"
-            current_args = ["./plot.R", str(logfile)]
             file_arg = "{}/facet_{}_{}.pdf".format(out_folder, size, mmt_name)
-            current_args.extend([file_arg, "facet", str(size), message, mmt])
-            run(current_args)
+            current_args = ["./plot.R", str(size_logfile), file_arg, "facet",
+                            str(size), message, mmt]
+            run_cached(cache, current_args, file_arg, size_digest)
+        cache.save()
+    cache.save()
+
+def python_plot(out_folder, logfile, sizes, db=None, force=False):
+    """
+    Renders every figure with render.py: the results are loaded once and the
+    figures whose inputs changed are drawn in a process pool. Returns False
+    if matplotlib is missing.
+    """
+    try:
+        import matplotlib
+    except ImportError:
+        debug("matplotlib is not installed, falling back to plot.R")
+        return False
+    import render
+    if db is not None:
+        rows = [render.parse_row(record) for record in query(db)]
+        rows = [row for row in rows if row is not None]
+    else:
+        rows = render.load_results(logfile)
+    cache = PlotCache(out_folder, force)
+    code = source_digest("render.py")
+    stale = []
+    for spec in render.figure_specs(rows, sizes, out_folder):
+        # each spec holds exactly the summarized series its figure shows
+        fingerprint = digest(code, json.dumps(
+            dict(spec, outfile=os.path.basename(spec["outfile"])), sort_keys=True))
+        if cache.fresh(spec["outfile"], fingerprint):
+            debug("Unchanged: {}".format(spec["outfile"]))
+        else:
+            stale.append((spec, fingerprint))
+    if len(stale) > 0:
+        for (outfile, (_, fingerprint)) in zip(
+                render.render_all([spec for (spec, _) in stale]), stale):
+            cache.record(outfile, fingerprint)
+            debug("Wrote {}".format(outfile))
+    cache.save()
+    return True
 
 def main():
     args = parse_args()
@@ -74,10 +179,22 @@ def main():
     out_folder = folder / "plots"
     if not os.path.exists(out_folder):
         os.mkdir(out_folder)
-    sizes = get_sizes(args.folder)
+    db = None
+    if args.db is not None:
+        db = open_db(args.db)
+        sizes = distinct_sizes(db)
+    else:
+        sizes = get_sizes(args.folder)
+    if args.backend == "python" and \
+            python_plot(out_folder, logfile, sizes, db, args.force):
+        return
+    if db is not None:
+        # plot.R reads CSV, so export the full table once and one slice per size
+        logfile = out_folder / "results.csv"
+        export_csv(db, logfile, CSV_FIELDS)
 
     # make the plots
-    iterate_plot(out_folder, logfile, sizes, args.message)
+    iterate_plot(out_folder, logfile, sizes, args.message, db, args.force)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,272 @@
+import argparse
+import os
+import sys
+from pathlib import Path
+"""
+Folded call stacks from --profile runs, and a differential report between
+two systems.
+
+With --profile, start_server wraps the server in `perf record -g` and, after
+the run, `perf script` output is folded into one "frame;frame;... count"
+line per distinct stack (root first), the format flamegraph.pl and
+speedscope read. The folded file lives next to the trial's other logs.
+
+The report turns each system's self-time shares into ns per request using
+the trial's throughput, so a symbol's delta is its contribution to the gap
+in per-request server time between the two systems. That holds while the
+server core is saturated, so compare points at the top of the load range.
+
+Usage:
+    python profiles.py -l <logfolder> -a cornflakes -b protobuf -s 1024 -n 8
+"""
+PERF_DATA = "server.perf.data"
+PERF_SCRIPT = "server.perf.script"
+FOLDED = "server.folded"
+DEFAULT_FREQUENCY = 999  # Hz; off the timer tick so samples do not alias
+
+
+def frame_name(line):
+    # "    7f3a2b1c func+0x1a (/path/to/binary)" -> "func"
+    parts = line.strip().split(" ", 1)
+    if len(parts) < 2:
+        return None
+    symbol, _, dso = parts[1].rpartition(" (")
+    symbol = symbol.rsplit("+0x", 1)[0]
+    if symbol in ("", "[unknown]"):
+        return "[{}]".format(os.path.basename(dso.rstrip(")")))
+    return symbol
+
+
+def fold_perf_script(lines):
+    """
+    Folds `perf script` output into {stack: samples}; stacks are root first,
+    prefixed with the command name.
+    """
+    stacks = {}
+    comm = None
+    frames = []
+
+    def flush():
+        if comm is not None and len(frames) > 0:
+            stack = ";".join([comm] + frames[::-1])
+            stacks[stack] = stacks.get(stack, 0) + 1
+
+    for line in lines:
+        if line.startswith("#"):
+            continue
+        if line.strip() == "":
+            flush()
+            comm = None
+            frames = []
+        elif line[0] in " \t":
+            frame = frame_name(line)
+            if frame is not None:
+                frames.append(frame)
+        else:
+            comm = line.split()[0]
+    flush()
+    return stacks
+
+
+def write_folded(path, stacks):
+    with open(path, "w") as f:
+        for stack in sorted(stacks):
+            f.write("{} {}\n".format(stack, stacks[stack]))
+
+
+def read_folded(path):
+    stacks = {}
+    with open(path) as f:
+        for line in f:
+            stack, _, count = line.rstrip("\n").rpartition(" ")
+            if stack != "":
+                stacks[stack] = stacks.get(stack, 0) + int(count)
+    return stacks
+
+
+def merge_folded(stacks_list):
+    merged = {}
+    for stacks in stacks_list:
+        for (stack, count) in stacks.items():
+            merged[stack] = merged.get(stack, 0) + count
+    return merged
+
+
+def fold_trial(final_path):
+    """
+    Folds the trial's PERF_SCRIPT into FOLDED; returns the number of samples,
+    or None if perf script produced nothing.
+    """
+    script = Path(final_path) / PERF_SCRIPT
+    if not os.path.exists(script):
+        return None
+    with open(script, errors="replace") as f:
+        stacks = fold_perf_script(f)
+    if len(stacks) == 0:
+        return None
+    write_folded(Path(final_path) / FOLDED, stacks)
+    return sum(stacks.values())
+
+
+def self_shares(stacks):
+    """
+    Fraction of samples in which each symbol was the leaf frame.
+    """
+    total = float(sum(stacks.values()))
+    shares = {}
+    if total == 0:
+        return shares
+    for (stack, count) in stacks.items():
+        leaf = stack.rsplit(";", 1)[-1]
+        shares[leaf] = shares.get(leaf, 0.0) + count / total
+    return shares
+
+
+def mean(values):
+    return sum(values) / float(len(values))
+
+
+def load_point(logfile, system, size, message, num_clients, placement):
+    """
+    Merged folded stacks and mean throughput (req/ms) over every profiled
+    trial of one point; (None, None) if there are none.
+    """
+    from harness.analysis import walk_trials
+    from parse_data import LAYOUT, parse_folder_cached
+    trials = walk_trials(logfile, LAYOUT,
+                         {"system": [system], "message": [message],
+                          "size": [size], "num_clients": [num_clients],
+                          "placement": [placement]})
+    stacks = []
+    tputs = []
+    for trial in trials:
+        if not os.path.exists(trial["path"] / FOLDED):
+            continue
+        record, _ = parse_folder_cached(trial["path"], system, message, size,
+                                        trial["trial"], num_clients)
+        if record is None:
+            continue
+        stacks.append(read_folded(trial["path"] / FOLDED))
+        tputs.append(record["tput"])
+    if len(stacks) == 0:
+        return None, None
+    return merge_folded(stacks), mean(tputs)
+
+
+def clean_tput(logfile, system, size, message, num_clients, placement):
+    """
+    Mean throughput over the point's unprofiled trials, or None.
+    """
+    from harness.analysis import walk_trials
+    from parse_data import LAYOUT, parse_folder_cached
+    trials = walk_trials(logfile, LAYOUT,
+                         {"system": [system], "message": [message],
+                          "size": [size], "num_clients": [num_clients],
+                          "placement": [placement]})
+    tputs = []
+    for trial in trials:
+        if os.path.exists(trial["path"] / FOLDED):
+            continue
+        record, _ = parse_folder_cached(trial["path"], system, message, size,
+                                        trial["trial"], num_clients)
+        if record is not None:
+            tputs.append(record["tput"])
+    return mean(tputs) if len(tputs) > 0 else None
+
+
+def diff_report(stacks_a, tput_a, stacks_b, tput_b, cores=1):
+    """
+    Per-symbol rows (symbol, share a, share b, ns/req a, ns/req b, delta),
+    largest absolute delta first; delta > 0 means b spends more per request.
+    cores is the number of server cores both points ran on.
+    """
+    shares_a = self_shares(stacks_a)
+    shares_b = self_shares(stacks_b)
+    # tput is in req/ms, so cores * 1e6 / tput is the server core time per
+    # request in ns
+    ns_a = cores * 1000000.0 / tput_a
+    ns_b = cores * 1000000.0 / tput_b
+    rows = []
+    for symbol in set(shares_a) | set(shares_b):
+        share_a = shares_a.get(symbol, 0.0)
+        share_b = shares_b.get(symbol, 0.0)
+        rows.append((symbol, share_a, share_b, share_a * ns_a, share_b * ns_b,
+                     share_b * ns_b - share_a * ns_a))
+    rows.sort(key=lambda row: -abs(row[5]))
+    return rows
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-l", "--logfile",
+                        help = "Base logfile of the profiled sweep",
+                        required = True)
+    parser.add_argument("-a", "--system_a",
+                        help = "Baseline system",
+                        required = True)
+    parser.add_argument("-b", "--system_b",
+                        help = "System compared against the baseline",
+                        required = True)
+    parser.add_argument("-s", "--size",
+                        type = int,
+                        required = True)
+    parser.add_argument("-m", "--message",
+                        default = "Get")
+    parser.add_argument("-n", "--num_clients",
+                        help = "Total client count of the point to compare",
+                        type = int,
+                        required = True)
+    parser.add_argument("-p", "--placement",
+                        help = "Server placement tag of the point, e.g. cores0-3",
+                        default = "cores0")
+    parser.add_argument("-c", "--clean",
+                        help = "Base logfile of an unprofiled sweep, to report profiling overhead",
+                        default = None)
+    parser.add_argument("-t", "--top",
+                        help = "Number of symbols to show",
+                        type = int,
+                        default = 25)
+    parser.add_argument("-o", "--outfile",
+                        help = "Also write every row to this CSV",
+                        default = None)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    point = (args.size, args.message, args.num_clients, args.placement)
+    stacks_a, tput_a = load_point(args.logfile, args.system_a, *point)
+    stacks_b, tput_b = load_point(args.logfile, args.system_b, *point)
+    for (system, stacks) in [(args.system_a, stacks_a), (args.system_b, stacks_b)]:
+        if stacks is None:
+            print("No profiled trials for {} at size {}, {} clients".format(
+                system, args.size, args.num_clients), file=sys.stderr)
+            exit(1)
+    print("{}: {:.2f} req/ms, {:.1f} ns/req; {}: {:.2f} req/ms, {:.1f} ns/req".format(
+        args.system_a, tput_a, 1000000.0 / tput_a,
+        args.system_b, tput_b, 1000000.0 / tput_b))
+    if args.clean is not None:
+        for (system, tput) in [(args.system_a, tput_a), (args.system_b, tput_b)]:
+            clean = clean_tput(args.clean, system, *point)
+            if clean is None:
+                print("{}: no clean trials to measure overhead".format(system))
+            else:
+                print("{}: profiling overhead {:.1f}% ({:.2f} req/ms clean)".format(
+                    system, (1.0 - tput / clean) * 100, clean))
+    from placement import tag_cores
+    rows = diff_report(stacks_a, tput_a, stacks_b, tput_b,
+                       tag_cores(args.placement) or 1)
+    print("{:>10} {:>10} {:>12} {:>12} {:>12}  {}".format(
+        "self a", "self b", "ns/req a", "ns/req b", "delta", "symbol"))
+    for (symbol, share_a, share_b, ns_a, ns_b, delta) in rows[:args.top]:
+        print("{:>9.2f}% {:>9.2f}% {:>12.1f} {:>12.1f} {:>+12.1f}  {}".format(
+            share_a * 100, share_b * 100, ns_a, ns_b, delta, symbol))
+    if args.outfile is not None:
+        with open(args.outfile, "w") as f:
+            f.write("symbol,share_a,share_b,ns_per_req_a,ns_per_req_b,delta\n")
+            for row in rows:
+                f.write('"{}",{},{},{},{},{}\n'.format(*row))
+
+
+if __name__ == '__main__':
+    main()
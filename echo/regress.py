@@ -0,0 +1,276 @@
+import argparse
+import csv
+import os
+import sqlite3
+import sys
+from statistics import median
+from placement import DEFAULT_TAG
+from stats import mann_whitney_u, min_p_value, cliffs_delta, bootstrap_median_diff, adjust_p_values
+"""
+Flags statistically significant performance changes between two sweeps.
+
+Each side is a parse_data CSV, a results database (.db), or a log folder.
+Trials are grouped by (system, message, size, num_clients, placement), and
+for every point and metric both sides' per-trial values are compared with a
+two-sided Mann-Whitney U test (or a bootstrap on the medians). With many
+points and metrics some raw p values fall below alpha by chance, so the p
+values of all rows are adjusted together (--correction, Holm by default) and
+a change is a regression when its adjusted p value is below --alpha and the
+medians moved by more than --threshold in the bad direction. The exit status
+is 1 if any point regressed, so a nightly run can gate on it.
+
+The exact test cannot reach p < 0.05 with fewer than 4 trials per side
+(3 vs 3 gives at best p = 0.1), and after the adjustment the smallest p value
+is multiplied by up to the number of rows; points that cannot reach --alpha
+either way are reported as "few trials".
+
+Usage:
+    python regress.py -b baseline.csv -c candidate.csv [-o changes.csv]
+"""
+# metric -> +1 if higher is better, -1 if lower is better
+METRICS = {"tput": 1, "tputgbps": 1, "median": -1, "avg": -1, "p99": -1,
+           "p999": -1, "p9999": -1, "cycles_per_req": -1,
+           "instructions_per_req": -1, "llc_misses_per_req": -1,
+           "dtlb_misses_per_req": -1, "ipc": 1}
+DEFAULT_METRICS = ["tput", "p99"]
+DEFAULT_ALPHA = 0.05
+KEY = ["system", "message", "size", "num_clients", "placement"]
+OUT_FIELDS = KEY + ["metric", "n_baseline", "n_candidate", "baseline_median",
+                    "candidate_median", "change_pct", "cliffs_delta", "p_value",
+                    "p_adjusted", "verdict"]
+CORRECTIONS = ["holm", "bh", "none"]
+
+
+def load_csv(path):
+    with open(path) as f:
+        return list(csv.DictReader(f))
+
+
+def load_db(path):
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    try:
+        return [dict(row) for row in conn.execute("SELECT * FROM results")]
+    finally:
+        conn.close()
+
+
+def load_logs(logfile, processes=None):
+    from harness.analysis import walk_trials, parse_trials, trial_jobs
+    from parse_data import LAYOUT, parse_folder_cached
+    trials = walk_trials(logfile, LAYOUT)
+    ret = parse_trials(parse_folder_cached, trial_jobs(
+        trials, ["system", "message", "size", "trial", "num_clients"]),
+        processes)
+    return [record for (record, _) in ret if record is not None]
+
+
+def load_records(path):
+    if os.path.isdir(path):
+        return load_logs(path)
+    if path.endswith(".db"):
+        return load_db(path)
+    return load_csv(path)
+
+
+def to_float(value):
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if value != value else value
+
+
+def group_trials(records, metrics):
+    """
+    {point key: {metric: [per-trial values]}}; missing values are skipped.
+    """
+    points = {}
+    for record in records:
+        key = (record["system"], str(record["message"]), int(record["size"]),
+               int(record["num_clients"]), record.get("placement") or DEFAULT_TAG)
+        values = points.setdefault(key, {metric: [] for metric in metrics})
+        for metric in metrics:
+            value = to_float(record.get(metric))
+            if value is not None:
+                values[metric].append(value)
+    return points
+
+
+def compare_metric(baseline, candidate, direction, alpha, threshold,
+                   test="mannwhitney"):
+    """
+    Compares one metric's per-trial values; returns the OUT_FIELDS after the
+    key and metric name. The verdict uses the raw p value until compare
+    adjusts it.
+    """
+    row = {"n_baseline": len(baseline), "n_candidate": len(candidate),
+           "baseline_median": None, "candidate_median": None,
+           "change_pct": None, "cliffs_delta": None, "p_value": None,
+           "p_adjusted": None}
+    if len(baseline) == 0 or len(candidate) == 0:
+        row["verdict"] = "missing"
+        return row
+    base = median(baseline)
+    cand = median(candidate)
+    row["baseline_median"] = base
+    row["candidate_median"] = cand
+    row["change_pct"] = (cand - base) / base * 100 if base != 0 else None
+    row["cliffs_delta"] = cliffs_delta(baseline, candidate)
+    if test == "bootstrap":
+        row["p_value"] = bootstrap_median_diff(baseline, candidate)
+    else:
+        _, row["p_value"] = mann_whitney_u(candidate, baseline)
+    row["p_adjusted"] = row["p_value"]
+    row["verdict"] = verdict(row, direction, alpha, threshold, test)
+    return row
+
+
+def verdict(row, direction, alpha, threshold, test="mannwhitney", family=1):
+    """
+    Judges a compared row by its p_adjusted and the change of the medians.
+    family is the number of p values adjusted together; the exact test's
+    smallest p value, adjusted, must still be able to reach alpha.
+    """
+    base = row["baseline_median"]
+    cand = row["candidate_median"]
+    # positive when the candidate is better
+    gain = direction * (cand - base) / abs(base) if base != 0 else 0.0
+    # a nan p value (e.g. a bootstrap without samples) is never significant
+    if not row["p_adjusted"] < alpha or abs(gain) <= threshold:
+        if test == "mannwhitney" and \
+                min_p_value(row["n_baseline"], row["n_candidate"]) * family >= alpha:
+            return "few trials"
+        return "unchanged"
+    return "improvement" if gain > 0 else "regression"
+
+
+def compare(baseline_records, candidate_records, metrics, alpha, threshold,
+            test="mannwhitney", correction="holm"):
+    """
+    Compares every point and metric. Unless correction is "none", the p
+    values of all compared rows are adjusted as one family before the
+    verdicts.
+    """
+    baseline = group_trials(baseline_records, metrics)
+    candidate = group_trials(candidate_records, metrics)
+    rows = []
+    for key in sorted(set(baseline) | set(candidate)):
+        for metric in metrics:
+            row = compare_metric(baseline.get(key, {}).get(metric, []),
+                                 candidate.get(key, {}).get(metric, []),
+                                 METRICS[metric], alpha, threshold, test)
+            row.update(dict(zip(KEY, key)))
+            row["metric"] = metric
+            rows.append(row)
+    if correction != "none":
+        adjusted = adjust_p_values([row["p_value"] for row in rows], correction)
+        family = len([row for row in rows if row["p_value"] is not None])
+        for (row, p_adjusted) in zip(rows, adjusted):
+            if row["p_value"] is None:
+                continue
+            row["p_adjusted"] = p_adjusted
+            row["verdict"] = verdict(row, METRICS[row["metric"]], alpha,
+                                     threshold, test, family)
+    return rows
+
+
+def format_value(value, spec):
+    return "NA" if value is None else format(value, spec)
+
+
+def print_rows(rows):
+    print("{:<20} {:<8} {:>6} {:>4} {:<10} {:<6} {:>12} {:>12} {:>8} {:>6} {:>7} {:>7}  {}".format(
+        "system", "message", "size", "n", "placement", "metric", "baseline",
+        "candidate", "change", "delta", "p", "p adj", "verdict"))
+    for row in rows:
+        print("{:<20} {:<8} {:>6} {:>4} {:<10} {:<6} {:>12} {:>12} {:>7}% {:>6} {:>7} {:>7}  {}".format(
+            row["system"], row["message"], row["size"], row["num_clients"],
+            row["placement"], row["metric"],
+            format_value(row["baseline_median"], ".2f"),
+            format_value(row["candidate_median"], ".2f"),
+            format_value(row["change_pct"], "+.1f"),
+            format_value(row["cliffs_delta"], "+.2f"),
+            format_value(row["p_value"], ".4f"),
+            format_value(row["p_adjusted"], ".4f"), row["verdict"]))
+
+
+def write_rows(outfile, rows):
+    with open(outfile, "w") as f:
+        f.write(",".join(OUT_FIELDS) + "\n")
+        for row in rows:
+            f.write(",".join(["NA" if row[field] is None else str(row[field])
+                              for field in OUT_FIELDS]) + "\n")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-b", "--baseline",
+                        help = "Baseline sweep: parse_data CSV, results .db or log folder",
+                        required = True)
+    parser.add_argument("-c", "--candidate",
+                        help = "Candidate sweep, in any of the same forms",
+                        required = True)
+    parser.add_argument("-m", "--metrics",
+                        help = "Metrics to compare",
+                        nargs = "+",
+                        choices = list(METRICS),
+                        default = DEFAULT_METRICS)
+    parser.add_argument("-a", "--alpha",
+                        help = "Significance level, applied to the adjusted p values",
+                        type = float,
+                        default = DEFAULT_ALPHA)
+    parser.add_argument("-t", "--threshold",
+                        help = "Smallest relative change of the medians that counts, e.g. 0.05 for 5%%",
+                        type = float,
+                        default = 0.05)
+    parser.add_argument("-te", "--test",
+                        help = "Per-point significance test",
+                        choices = ["mannwhitney", "bootstrap"],
+                        default = "mannwhitney")
+    parser.add_argument("-co", "--correction",
+                        help = "Multiple-comparison adjustment of the p values across all rows: Holm, Benjamini-Hochberg or none",
+                        choices = CORRECTIONS,
+                        default = "holm")
+    parser.add_argument("-sys", "--systems",
+                        help = "Only compare these systems",
+                        nargs = "+",
+                        default = [])
+    parser.add_argument("-all", "--all",
+                        help = "Print every point, not just the changed ones",
+                        action = "store_true")
+    parser.add_argument("-o", "--outfile",
+                        help = "Also write every row to this CSV",
+                        default = None)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    baseline = load_records(args.baseline)
+    candidate = load_records(args.candidate)
+    if len(args.systems) > 0:
+        baseline = [record for record in baseline if record["system"] in args.systems]
+        candidate = [record for record in candidate if record["system"] in args.systems]
+    rows = compare(baseline, candidate, args.metrics, args.alpha,
+                   args.threshold, args.test, args.correction)
+    if args.outfile is not None:
+        write_rows(args.outfile, rows)
+    counts = {}
+    for row in rows:
+        counts[row["verdict"]] = counts.get(row["verdict"], 0) + 1
+    shown = rows if args.all else [row for row in rows
+                                   if row["verdict"] in ("regression", "improvement")]
+    if len(shown) > 0:
+        print_rows(shown)
+    print(", ".join(["{} {}".format(counts[verdict], verdict)
+                     for verdict in sorted(counts)]))
+    if counts.get("few trials", 0) > 0:
+        print("{} comparisons had too few trials to reach alpha {}".format(
+            counts["few trials"], args.alpha), file=sys.stderr)
+    if counts.get("regression", 0) > 0:
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()
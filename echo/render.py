@@ -0,0 +1,190 @@
+import csv
+import multiprocessing as mp
+from statistics import mean, median
+"""
+Python plotting backend for plot.py.
+
+The parsed results are read once, reduced per (system, placement, size,
+message, num_clients) point, and each figure is rendered in its own worker
+process from just the series it needs. It draws the same figures plot.R does:
+size.pdf and size_gbps.pdf (medians across trials, faceted by size and
+latency metric), and facet_<size>_<metric>.pdf (means across trials).
+
+matplotlib is imported by the workers only, so plot.py can fall back to
+plot.R when it is not installed.
+"""
+SYSTEM_ORDER = ["protobuf", "capnproto", "protobytes", "flatbuffers",
+                "baseline", "baseline_zero_copy", "cornflakes"]
+LABELS = {"protobuf": "Protobuf", "protobytes": "Protobytes",
+          "capnproto": "Capnproto", "flatbuffers": "Flatbuffers",
+          "baseline": "No Serialization", "baseline_zero_copy": "DPDK Single Core",
+          "cornflakes": "Prototype\nLibrary"}
+COLORS = {"baseline_zero_copy": "#1b9e77", "baseline": "#d95f02",
+          "flatbuffers": "#7570b3", "capnproto": "#e7298a",
+          "protobytes": "#66a61e", "protobuf": "#e6ab02",
+          "cornflakes": "#000000"}
+# closest matplotlib markers to plot.R's ggplot shapes
+MARKERS = {"protobuf": "X", "protobytes": "x", "capnproto": "D",
+           "flatbuffers": "^", "baseline": "s", "baseline_zero_copy": "o",
+           "cornflakes": "o"}
+HOLLOW = ["cornflakes"]
+DASHED = ["cornflakes"]
+# (summary key, CSV column, axis label), in plot.R's facet order
+METRICS = [("mavg", "avg", "Avg Latency (µs)"),
+           ("mp99", "p99", "p99 Latency (µs)"),
+           ("avgmedian", "median", "Median Latency (µs)")]
+FACET_NAMES = {"mavg": "avg", "mp99": "p99", "avgmedian": "median"}
+DEFAULT_PLACEMENT = "cores0"
+WIDTH = 9
+HEIGHT = 6
+
+
+def parse_row(row):
+    """
+    The fields plots need from a parse_data row (a CSV row or a results_db
+    record), with numbers converted; None if any is missing.
+    """
+    try:
+        parsed = {"system": row["system"], "message": str(row["message"]),
+                  "placement": row.get("placement") or DEFAULT_PLACEMENT,
+                  "size": int(row["size"]),
+                  "num_clients": int(row["num_clients"])}
+        for field in ["tput", "tputgbps", "avg", "p99", "median"]:
+            parsed[field] = float(row[field])
+    except (KeyError, ValueError, TypeError):
+        return None
+    return parsed
+
+
+def load_results(path):
+    """
+    Parsed rows of a parse_data CSV; rows with missing values are dropped.
+    """
+    with open(path) as f:
+        rows = [parse_row(row) for row in csv.DictReader(f)]
+    return [row for row in rows if row is not None]
+
+
+def summarize(rows, tput_field, reduce):
+    """
+    Reduces the trials of every point with reduce (median or mean), like
+    plot.R's ddply summaries.
+    """
+    points = {}
+    for row in rows:
+        key = (row["system"], row["placement"], row["size"], row["message"],
+               row["num_clients"])
+        points.setdefault(key, []).append(row)
+    summary = {}
+    for (key, trials) in points.items():
+        summary[key] = {"mtput": reduce([trial[tput_field] for trial in trials])}
+        for (name, field, _) in METRICS:
+            summary[key][name] = reduce([trial[field] for trial in trials])
+    return summary
+
+
+def series_label(system, placement):
+    label = LABELS.get(system, system)
+    if placement != DEFAULT_PLACEMENT:
+        return "{} ({})".format(label, placement)
+    return label
+
+
+def series(summary, size):
+    """
+    One line per (system, placement) at size: its points sorted by throughput,
+    as geom_line draws them.
+    """
+    lines = {}
+    for ((system, placement, point_size, _, _), values) in summary.items():
+        if point_size != size:
+            continue
+        lines.setdefault((system, placement), []).append(values)
+    order = lambda key: (SYSTEM_ORDER.index(key[0]) if key[0] in SYSTEM_ORDER
+                         else len(SYSTEM_ORDER), key)
+    return [{"system": system, "label": series_label(system, placement),
+             "points": sorted(lines[(system, placement)], key=lambda p: p["mtput"])}
+            for (system, placement) in sorted(lines, key=order)]
+
+
+def figure_specs(rows, sizes, out_folder):
+    """
+    Everything each worker needs to draw one figure, without the raw rows.
+    """
+    medians = summarize(rows, "tput", median)
+    gbps_medians = summarize(rows, "tputgbps", median)
+    gbps_means = summarize(rows, "tputgbps", mean)
+    specs = [{"outfile": "{}/size.pdf".format(out_folder), "kind": "grid",
+              "xlabel": "Throughput (Requests/ms)", "ylabel": "Latency (µs)",
+              "rows": [(size, series(medians, size)) for size in sizes]},
+             {"outfile": "{}/size_gbps.pdf".format(out_folder), "kind": "grid",
+              "xlabel": "Throughput (Gbps)", "ylabel": "Latency (microseconds)",
+              "rows": [(size, series(gbps_medians, size)) for size in sizes]}]
+    for size in sizes:
+        for (name, _, ylabel) in METRICS:
+            specs.append({"outfile": "{}/facet_{}_{}.pdf".format(
+                              out_folder, size, FACET_NAMES[name]),
+                          "kind": "single", "metric": name,
+                          "xlabel": "Throughput (Gbps)", "ylabel": ylabel,
+                          "series": series(gbps_means, size)})
+    return specs
+
+
+def draw_series(ax, lines, metric):
+    for line in lines:
+        system = line["system"]
+        color = COLORS.get(system)
+        ax.plot([point["mtput"] for point in line["points"]],
+                [point[metric] for point in line["points"]],
+                color=color, marker=MARKERS.get(system, "o"), markersize=7,
+                markerfacecolor="none" if system in HOLLOW else color,
+                linestyle="--" if system in DASHED else "-", linewidth=1.5,
+                label=line["label"])
+    ax.set_xlim(left=0)
+    ax.set_ylim(bottom=0)
+    ax.grid(True, color="#dddddd", linewidth=0.5)
+
+
+def render(spec):
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    if spec["kind"] == "grid":
+        nrows = max(len(spec["rows"]), 1)
+        fig, axes = plt.subplots(nrows, len(METRICS), figsize=(WIDTH, HEIGHT),
+                                 squeeze=False)
+        for (row, (size, lines)) in enumerate(spec["rows"]):
+            for (col, (name, _, _)) in enumerate(METRICS):
+                ax = axes[row][col]
+                draw_series(ax, lines, name)
+                if row == 0:
+                    ax.set_title(name, fontsize=9)
+                if col == len(METRICS) - 1:
+                    ax.yaxis.set_label_position("right")
+                    ax.set_ylabel(str(size), fontsize=9)
+        fig.supxlabel(spec["xlabel"])
+        fig.supylabel(spec["ylabel"])
+    else:
+        fig, ax = plt.subplots(figsize=(WIDTH, HEIGHT))
+        draw_series(ax, spec["series"], spec["metric"])
+        ax.set_xlabel(spec["xlabel"], fontsize=20)
+        ax.set_ylabel(spec["ylabel"], fontsize=20)
+        ax.tick_params(labelsize=16)
+    handles, labels = fig.axes[0].get_legend_handles_labels()
+    if len(handles) > 0:
+        fig.legend(handles, labels, loc="upper center", ncol=min(len(labels), 7),
+                   frameon=False)
+        fig.tight_layout(rect=(0, 0, 1, 0.92))
+    else:
+        fig.tight_layout()
+    fig.savefig(spec["outfile"])
+    plt.close(fig)
+    return spec["outfile"]
+
+
+def render_all(specs, processes=None):
+    if processes is None:
+        processes = mp.cpu_count()
+    processes = max(1, min(processes, len(specs)))
+    with mp.Pool(processes) as pool:
+        return pool.map(render, specs)
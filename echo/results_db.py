@@ -0,0 +1,112 @@
+import sqlite3
+from placement import DEFAULT_TAG
+"""
+SQLite-backed store for parsed per-trial results.
+
+One row per (system, message, size, num_clients, placement, trial);
+re-parsing a trial replaces its row instead of appending a duplicate. Plotting and comparison
+scripts use query() to pull only the slice they need.
+"""
+KEY_COLUMNS = ["system", "message", "size", "num_clients", "placement", "trial"]
+COLUMNS = [("system", "TEXT"), ("message", "TEXT"), ("size", "INTEGER"),
+           ("num_clients", "INTEGER"), ("trial", "INTEGER"),
+           ("median", "REAL"), ("avg", "REAL"), ("p99", "REAL"),
+           ("tput", "REAL"), ("tputgbps", "REAL"), ("retries", "INTEGER"),
+           ("p999", "REAL"), ("p9999", "REAL"), ("tput_source", "TEXT"),
+           ("tput_littles", "REAL"), ("cycles_per_req", "REAL"),
+           ("instructions_per_req", "REAL"), ("llc_misses_per_req", "REAL"),
+           ("dtlb_misses_per_req", "REAL"), ("ipc", "REAL"),
+           ("profile_freq", "INTEGER"), ("placement", "TEXT"),
+           ("server_cores", "INTEGER"), ("server_cpu_max", "REAL"),
+           ("server_cpu_mean", "REAL"), ("server_softirq_per_s", "REAL"),
+           ("server_nic_gbps", "REAL"), ("server_nic_util", "REAL"),
+           ("server_nic_drops_per_s", "REAL"), ("server_membw_gbps", "REAL"),
+           ("client_cpu_max", "REAL"), ("bottleneck", "TEXT")]
+COLUMN_NAMES = [name for (name, _) in COLUMNS]
+
+
+def create_table(conn, table):
+    conn.execute("CREATE TABLE IF NOT EXISTS {} ({}, PRIMARY KEY ({}))".format(
+        table,
+        ", ".join(["{} {}".format(name, kind) for (name, kind) in COLUMNS]),
+        ", ".join(KEY_COLUMNS)))
+
+
+def open_db(path):
+    conn = sqlite3.connect(str(path))
+    conn.row_factory = sqlite3.Row
+    create_table(conn, "results")
+    # databases created by older versions are missing newer columns
+    info = list(conn.execute("PRAGMA table_info(results)"))
+    existing = [row["name"] for row in info]
+    for (name, kind) in COLUMNS:
+        if name not in existing:
+            conn.execute("ALTER TABLE results ADD COLUMN {} {}".format(name, kind))
+    # a primary key column cannot be added in place, so older tables are
+    # copied into a new one; their trials all ran on the default placement
+    key = [row["name"] for row in sorted(info, key=lambda row: row["pk"]) if row["pk"] > 0]
+    if key != KEY_COLUMNS:
+        conn.execute("UPDATE results SET placement = ? WHERE placement IS NULL",
+                     [DEFAULT_TAG])
+        conn.execute("UPDATE results SET server_cores = 1 WHERE server_cores IS NULL")
+        create_table(conn, "results_new")
+        conn.execute("INSERT INTO results_new ({0}) SELECT {0} FROM results".format(
+            ", ".join(COLUMN_NAMES)))
+        conn.execute("DROP TABLE results")
+        conn.execute("ALTER TABLE results_new RENAME TO results")
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS results_system_size ON results (system, size)")
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS results_size ON results (size, num_clients)")
+    conn.commit()
+    return conn
+
+
+def upsert_records(conn, records):
+    """
+    Inserts result records (dicts keyed by COLUMN_NAMES), replacing any
+    existing row for the same trial.
+    """
+    conn.executemany("INSERT OR REPLACE INTO results ({}) VALUES ({})".format(
+        ", ".join(COLUMN_NAMES), ", ".join(["?"] * len(COLUMN_NAMES))),
+        [[record[name] for name in COLUMN_NAMES] for record in records])
+    conn.commit()
+
+
+def query(conn, system=None, message=None, size=None, num_clients=None,
+          trial=None, placement=None):
+    """
+    Returns all rows matching the given key values as dicts; unset filters
+    match everything, e.g. query(conn, system="protobuf", size=1024).
+    """
+    filters = {"system": system, "message": message, "size": size,
+               "num_clients": num_clients, "trial": trial,
+               "placement": placement}
+    clauses = []
+    values = []
+    for name in KEY_COLUMNS:
+        if filters[name] is not None:
+            clauses.append("{} = ?".format(name))
+            values.append(filters[name])
+    sql = "SELECT * FROM results"
+    if len(clauses) > 0:
+        sql += " WHERE {}".format(" AND ".join(clauses))
+    sql += " ORDER BY {}".format(", ".join(KEY_COLUMNS))
+    return [dict(row) for row in conn.execute(sql, values)]
+
+
+def export_csv(conn, outfile, fields, **filters):
+    """
+    Writes the rows matching filters to outfile in the parse_data CSV format
+    (columns given by fields), for consumers such as plot.R.
+    """
+    with open(outfile, "w") as f:
+        f.write("{}\n".format(",".join(fields)))
+        for row in query(conn, **filters):
+            f.write(",".join(["NA" if row[field] is None else str(row[field])
+                              for field in fields]) + "\n")
+
+
+def distinct_sizes(conn):
+    return [row["size"] for row in
+            conn.execute("SELECT DISTINCT size FROM results ORDER BY size")]
@@ -1,9 +1,9 @@
-from common import start_client, start_server, kill_client, kill_server, cleanup, debug, parse_params, run_tput_exp
-from parse_data import parse_log, convert_tput, parse_latencies, p99_func, mean_func, median_func
+from common import close_connections, start_client, start_server, kill_client, kill_server, cleanup, debug, parse_params, run_tput_exp, exp_name
+from parse_data import parse_log, convert_tput, parse_latency_log, summarize_latencies, measured_throughput, server_perf_metrics
 import os
 import argparse
 from pathlib import Path
-import heapq
+from harness.histogram import LatencyHistogram
 MAX_CLIENTS = 10
 
 
@@ -56,10 +56,23 @@ def parse_args():
     parser.add_argument("-pf", "--perf",
                         help="Run perf server side to observe cache statistics",
                         action="store_true")
+    parser.add_argument("-sc", "--server_cores",
+                        help="Cores to pin the server to, e.g. 0-3,8 (default: core 0, or all of --numa_node)",
+                        default=None)
+    parser.add_argument("-nn", "--numa_node",
+                        help="Bind the server's cores and memory to this NUMA node",
+                        type=int,
+                        default=None)
+    parser.add_argument("-cc", "--client_cores",
+                        help="Cores to pin each client process to",
+                        default=None)
     parser.add_argument("-z", "--zero_copy",
                         help="Zero copy mode on",
                         action="store_true")
-    return parser.parse_args()
+    args = parser.parse_args()
+    # one placement per run; only the sweep script takes --core_counts
+    args.core_counts = None
+    return args
 
 
 def mean(arr):
@@ -68,7 +81,10 @@ def mean(arr):
 
 def analyze_exp(data, final_path, num_clients, concurrent_clients):
     all_retries = 0
-    all_latencies = []
+    all_latencies = LatencyHistogram()
+    measured_tput = 0.0
+    timestamped = True
+    requests = 0
     for i in range(1, min(num_clients + 1, MAX_CLIENTS + 1)):
         client_err = "{}/client{}.err.log".format(final_path, i)
         client_log = "{}/client{}.log".format(final_path, i)
@@ -76,8 +92,9 @@ def analyze_exp(data, final_path, num_clients, concurrent_clients):
         if not(os.path.exists(final_path)):
             debug("Path {} does not exist".format(final_path))
             return
-        latency_list = parse_latencies(latencies_log)
-        all_latencies.append(latency_list)
+        latency_list, send_times, total = parse_latency_log(latencies_log)
+        all_latencies.record(latency_list)
+        requests += total
 
         retries_dict = parse_log(client_log)
         if len(retries_dict) > 0:
@@ -86,24 +103,42 @@ def analyze_exp(data, final_path, num_clients, concurrent_clients):
             retries = 0
 
         all_retries += retries
-        avg = mean_func(latency_list) / float(1000)
-        p99 = p99_func(latency_list) / float(1000)
-        median = median_func(latency_list) / float(1000)
+        median, p99, avg = summarize_latencies(latency_list)
+        avg = avg / float(1000)
+        p99 = p99 / float(1000)
+        median = median / float(1000)
         # there could be concurrent clients per client folder
         tput = 1.0 * concurrent_clients / avg * 1000
+        tput_source = "Little's law"
+        if send_times is not None:
+            tput, _ = measured_throughput(latency_list, send_times)
+            tput_source = "measured"
+            measured_tput += tput
+        else:
+            timestamped = False
         tput_converted = convert_tput(tput, data["size"])
-        debug("Client {} [{} concurrent] tput: {:.2f} req/ms | {:.2f} Gbps,avg latency: {:.2f} us, p99: {:.2f} us, median: {:.2f} us, {} retries, {} entries".format(i, concurrent_clients,
+        debug("Client {} [{} concurrent] {} tput: {:.2f} req/ms | {:.2f} Gbps,avg latency: {:.2f} us, p99: {:.2f} us, median: {:.2f} us, {} retries, {} entries".format(i, concurrent_clients, tput_source,
                                                                                                                                                                      tput, tput_converted, avg, p99, median, retries, len(latency_list)))
     # full tput
-    sorted_latencies = list(heapq.merge(*all_latencies))
-    median = median_func(sorted_latencies) / float(1000)
-    p99 = p99_func(sorted_latencies) / float(1000)
-    avg = mean_func(sorted_latencies) / float(1000)
+    summary = all_latencies.summary()
+    median = summary["median"] / float(1000)
+    p99 = summary["p99"] / float(1000)
+    p999 = summary["p999"] / float(1000)
+    avg = summary["avg"] / float(1000)
     tput = 1.0 * (num_clients * concurrent_clients) / avg * 1000
+    tput_source = "Little's law"
+    if timestamped:
+        tput = measured_tput
+        tput_source = "measured"
     tput_converted = convert_tput(tput, data["size"])
-    debug("Tput: {:.2f} req/ms | {:.2f} Gbps, avg: {:.2f} us, median: {:.2f} us, p99: {:.2f} us, {} retries".format(
-        tput, tput_converted,
-        avg, median, p99, all_retries))
+    debug("{} tput: {:.2f} req/ms | {:.2f} Gbps, avg: {:.2f} us, median: {:.2f} us, p99: {:.2f} us, p99.9: {:.2f} us, {} retries".format(
+        tput_source, tput, tput_converted,
+        avg, median, p99, p999, all_retries))
+    metrics = server_perf_metrics(final_path, requests)
+    if any([value is not None for value in metrics.values()]):
+        debug("Server per request: {}".format(", ".join(
+            ["{} {:.2f}".format(field, value) for (field, value) in metrics.items()
+             if value is not None])))
 
 
 def main():
@@ -114,9 +149,7 @@ def main():
         cleanup(data)
     # setup folder
     message = None if ("baseline" in data["system"]) else args.message
-    exp = "{}clients".format(args.num_clients)
-    if args.clients > 1:
-        exp = "{}clients".format(args.num_clients * args.clients)
+    exp = exp_name(args.num_clients, args.clients, data["placement"])
     if args.num_clients > MAX_CLIENTS:
         if args.num_clients % MAX_CLIENTS == 0:
             args.clients = (args.num_clients / MAX_CLIENTS)
@@ -151,6 +184,7 @@ def main():
             trial = "trial_{}".format(num_trials - n)
             path = full_path / trial
             analyze_exp(data, path, args.num_clients, args.clients)
+    close_connections()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,167 @@
+import math
+import random
+from statistics import mean, median, stdev
+"""
+Small statistics helpers for deciding how many trials a configuration needs,
+and for comparing a metric's per-trial values between two sweeps.
+"""
+# two-sided 95% Student t critical values by degrees of freedom; between
+# entries the next smaller df is used, which errs on the wide side
+T_CRITICAL_95 = {1: 12.706, 2: 4.303, 3: 3.182, 4: 2.776, 5: 2.571,
+                 6: 2.447, 7: 2.365, 8: 2.306, 9: 2.262, 10: 2.228,
+                 12: 2.179, 15: 2.131, 20: 2.086, 25: 2.060, 30: 2.042,
+                 60: 2.000}
+Z_95 = 1.96
+
+
+def t_critical(df):
+    if df > max(T_CRITICAL_95):
+        return Z_95
+    return T_CRITICAL_95[max([k for k in T_CRITICAL_95 if k <= df])]
+
+
+def confidence_interval(values):
+    """
+    Returns (mean, half width) of the 95% confidence interval of the mean.
+    """
+    if len(values) < 2:
+        return (values[0] if len(values) == 1 else float("nan")), float("inf")
+    half_width = t_critical(len(values) - 1) * stdev(values) / math.sqrt(len(values))
+    return mean(values), half_width
+
+
+def relative_ci_width(values):
+    """
+    Full width of the 95% confidence interval as a fraction of the mean.
+    """
+    center, half_width = confidence_interval(values)
+    if center == 0 or math.isinf(half_width):
+        return float("inf")
+    return 2 * half_width / abs(center)
+
+
+def mann_whitney_u(a, b):
+    """
+    Two-sided Mann-Whitney U test. Returns (U of a, p value). The p value is
+    exact (ties count a half) for small samples, and from the
+    tie-corrected normal approximation otherwise.
+    """
+    n1, n2 = len(a), len(b)
+    u = sum([1.0 if x > y else 0.5 if x == y else 0.0 for x in a for y in b])
+    if n1 == 0 or n2 == 0:
+        return u, float("nan")
+    if n1 * n2 <= 400:
+        # counts[k]: number of orderings of n1 + n2 distinct values with U = k
+        counts = u_distribution(n1, n2)
+        total = float(sum(counts))
+        center = n1 * n2 / 2.0
+        distance = abs(u - center)
+        tail = sum([count for (k, count) in enumerate(counts)
+                    if abs(k - center) >= distance - 1e-9])
+        return u, min(1.0, tail / total)
+    values = sorted(a + b)
+    ties = sum([t ** 3 - t for t in
+                [values.count(v) for v in set(values)]])
+    n = n1 + n2
+    sigma = math.sqrt(n1 * n2 / 12.0 * ((n + 1) - ties / float(n * (n - 1))))
+    if sigma == 0:
+        return u, 1.0
+    z = (abs(u - n1 * n2 / 2.0) - 0.5) / sigma
+    return u, min(1.0, math.erfc(max(z, 0) / math.sqrt(2)))
+
+
+def u_distribution(n1, n2):
+    # number of ways to get U = k with n1 and n2 samples, by the recurrence
+    # f(n1, n2, k) = f(n1 - 1, n2, k - n2) + f(n1, n2 - 1, k)
+    table = {}
+
+    def f(i, j):
+        if (i, j) in table:
+            return table[(i, j)]
+        if i == 0 or j == 0:
+            dist = [1]
+        else:
+            first = [0] * j + f(i - 1, j)
+            second = f(i, j - 1)
+            dist = [(first[k] if k < len(first) else 0) +
+                    (second[k] if k < len(second) else 0)
+                    for k in range(0, i * j + 1)]
+        table[(i, j)] = dist
+        return dist
+
+    return f(n1, n2)
+
+
+def min_p_value(n1, n2):
+    """
+    Smallest two-sided p value the exact test can reach with these sample
+    sizes; with 3 trials each it is 0.1.
+    """
+    return min(1.0, 2.0 / math.comb(n1 + n2, n1))
+
+
+def trials_to_reach(alpha, family=1):
+    """
+    Smallest number of trials per side with which the exact test can reach
+    alpha after a Holm or Benjamini-Hochberg adjustment over family p values
+    (a lone change among them is multiplied by family); 4 for one test at
+    0.05.
+    """
+    n = 1
+    while min_p_value(n, n) * family >= alpha:
+        n += 1
+    return n
+
+
+def cliffs_delta(a, b):
+    """
+    P(b > a) - P(b < a), in [-1, 1]; 0 means the samples overlap evenly.
+    """
+    if len(a) == 0 or len(b) == 0:
+        return float("nan")
+    greater = sum([1 for x in a for y in b if y > x])
+    less = sum([1 for x in a for y in b if y < x])
+    return (greater - less) / float(len(a) * len(b))
+
+
+def bootstrap_median_diff(a, b, resamples=10000, seed=0):
+    """
+    Two-sided bootstrap p value for the difference of medians (b - a):
+    twice the fraction of resampled differences on the far side of 0.
+    """
+    if len(a) == 0 or len(b) == 0:
+        return float("nan")
+    rng = random.Random(seed)
+    below = 0
+    above = 0
+    for _ in range(0, resamples):
+        diff = median(rng.choices(b, k=len(b))) - median(rng.choices(a, k=len(a)))
+        if diff <= 0:
+            below += 1
+        if diff >= 0:
+            above += 1
+    return min(1.0, 2.0 * min(below, above) / float(resamples))
+
+
+def adjust_p_values(p_values, method="holm"):
+    """
+    Multiple-comparison adjusted p values, in the order given: Holm's
+    step-down ("holm", bounds the chance of any false positive) or
+    Benjamini-Hochberg ("bh", bounds the expected share of false positives).
+    None and nan entries are not tested and stay as they are.
+    """
+    tested = sorted([idx for (idx, p) in enumerate(p_values)
+                     if p is not None and p == p], key=lambda idx: p_values[idx])
+    m = len(tested)
+    adjusted = list(p_values)
+    if method == "holm":
+        running = 0.0
+        for (rank, idx) in enumerate(tested):
+            running = max(running, min(1.0, (m - rank) * p_values[idx]))
+            adjusted[idx] = running
+    elif method == "bh":
+        running = 1.0
+        for (rank, idx) in reversed(list(enumerate(tested))):
+            running = min(running, m * p_values[idx] / (rank + 1))
+            adjusted[idx] = running
+    return adjusted
@@ -0,0 +1,231 @@
+import os
+import numpy as np
+"""
+Host telemetry sampled alongside an experiment.
+
+The sampler is a shell loop started on every host of the run. It dumps
+/proc/stat, /proc/net/dev and, where resctrl memory bandwidth monitoring is
+mounted, the mbm_total_bytes counters, at a fixed interval. It costs one
+fork of cat per interval and needs nothing installed on the hosts. After the
+run, the raw dump is turned into per-interval rates and stored compressed as
+<role>.telemetry.npz in the trial folder, and the dump is deleted.
+
+Kernel-bypass libOSes (dmtr-lwip, dmtr-rdma) busy-poll and never touch the
+kernel network stack, so for them the server core reads as fully busy and
+/proc/net/dev does not see the traffic; their bottleneck is "unknown".
+
+Samples are stamped with the host's own clock. The harness records each
+host's offset from its clock when the samplers start, and the measurement
+window is shifted by it before samples are picked.
+"""
+TELEMETRY_RAW = "{}.telemetry.raw"
+TELEMETRY = "{}.telemetry.npz"
+SAMPLER_NAME = "telemetry-sampler"
+DEFAULT_INTERVAL = 0.2  # seconds
+SAMPLE_MARK = "@"
+# /proc/stat softirq columns after the total
+NET_TX_SOFTIRQ = 3
+NET_RX_SOFTIRQ = 4
+CPU_SATURATED = 0.95
+NIC_SATURATED = 0.90
+BUSY_POLL_LIBOSES = ["dmtr-lwip", "dmtr-rdma"]
+TELEMETRY_FIELDS = ["server_cpu_max", "server_cpu_mean", "server_softirq_per_s",
+                    "server_nic_gbps", "server_nic_util", "server_nic_drops_per_s",
+                    "server_membw_gbps", "client_cpu_max", "bottleneck"]
+
+
+def sampler_cmd(outfile, interval=DEFAULT_INTERVAL):
+    """
+    Shell command that samples until killed (by SAMPLER_NAME) into outfile.
+    """
+    loop = ("for n in /sys/class/net/*; do echo \"speed ${{n##*/}} $(cat $n/speed 2>/dev/null)\"; done; "
+            "while :; do echo \"{mark} $(date +%s%N)\"; cat /proc/stat /proc/net/dev; "
+            "for f in /sys/fs/resctrl/mon_data/mon_L3_*/mbm_total_bytes; do "
+            "[ -r $f ] && echo \"mbm $(cat $f)\"; done; sleep {interval}; done").format(
+                mark=SAMPLE_MARK, interval=interval)
+    return "sh -c '{}' {} > {}".format(loop, SAMPLER_NAME, outfile)
+
+
+def parse_raw(lines):
+    """
+    Parses a raw dump into (speeds, samples): NIC link speeds in Mb/s, and one
+    dict of cumulative counters per sample.
+    """
+    speeds = {}
+    samples = []
+    sample = None
+    for line in lines:
+        fields = line.split()
+        if len(fields) == 0:
+            continue
+        if fields[0] == SAMPLE_MARK:
+            sample = {"t": int(fields[1]), "cpus": {}, "nics": {}, "mbm": None}
+            samples.append(sample)
+        elif fields[0] == "speed":
+            if len(fields) == 3 and fields[2].lstrip("-").isdigit() and int(fields[2]) > 0:
+                speeds[fields[1]] = int(fields[2])
+        elif sample is None:
+            continue
+        elif fields[0].startswith("cpu") and fields[0] != "cpu":
+            values = [int(value) for value in fields[1:]]
+            # idle and iowait are the 4th and 5th columns
+            sample["cpus"][int(fields[0][3:])] = (sum(values), values[3] + values[4])
+        elif fields[0] == "intr":
+            sample["intr"] = int(fields[1])
+        elif fields[0] == "softirq":
+            sample["net_rx"] = int(fields[1 + NET_RX_SOFTIRQ])
+            sample["net_tx"] = int(fields[1 + NET_TX_SOFTIRQ])
+        elif fields[0] == "mbm":
+            sample["mbm"] = (sample["mbm"] or 0) + int(fields[1])
+        elif ":" in line and "|" not in line:
+            name, _, counters = line.partition(":")
+            name = name.strip()
+            values = counters.split()
+            if name == "lo" or len(values) < 12:
+                continue
+            # rx bytes, packets, errs, drop, ... tx bytes, packets, errs, drop
+            sample["nics"][name] = (int(values[0]), int(values[1]), int(values[3]),
+                                    int(values[8]), int(values[9]), int(values[11]))
+    # the sampler may be killed halfway through a dump
+    if len(samples) > 0 and ("net_rx" not in samples[-1] or len(samples[-1]["nics"]) == 0):
+        samples.pop()
+    return speeds, samples
+
+
+def to_rates(speeds, samples):
+    """
+    Per-interval rates between consecutive samples, as arrays.
+    """
+    cpus = sorted(samples[0]["cpus"])
+    nics = sorted(samples[0]["nics"])
+    t = np.array([sample["t"] for sample in samples], dtype=np.int64)
+    dt = np.diff(t) / 1e9
+    totals = np.array([[sample["cpus"].get(cpu, (0, 0))[0] for cpu in cpus]
+                       for sample in samples], dtype=np.float64)
+    idles = np.array([[sample["cpus"].get(cpu, (0, 0))[1] for cpu in cpus]
+                      for sample in samples], dtype=np.float64)
+    elapsed = np.maximum(np.diff(totals, axis=0), 1)
+    nic_counters = np.array([[sample["nics"].get(nic, (0,) * 6) for nic in nics]
+                             for sample in samples], dtype=np.float64)
+
+    def rate(key):
+        return np.diff([sample.get(key, 0) for sample in samples]) / dt
+
+    rates = {"t": t[1:],
+             "cpu_busy": (1.0 - np.diff(idles, axis=0) / elapsed).astype(np.float32),
+             "cpus": np.array(cpus),
+             "intr_per_s": rate("intr"),
+             "net_rx_softirq_per_s": rate("net_rx"),
+             "net_tx_softirq_per_s": rate("net_tx"),
+             "nics": np.array(nics),
+             "nic_speed_mbps": np.array([speeds.get(nic, -1) for nic in nics]),
+             # per nic: rx bytes, rx packets, rx drops, tx bytes, tx packets, tx drops
+             "nic_per_s": (np.diff(nic_counters, axis=0) / dt[:, None, None]).astype(np.float32)}
+    if all([sample["mbm"] is not None for sample in samples]):
+        rates["mbm_bytes_per_s"] = rate("mbm")
+    return rates
+
+
+def compact(raw_path, out_path):
+    """
+    Converts a raw dump to rates in out_path and removes the dump. Returns
+    False if there were fewer than two complete samples.
+    """
+    with open(raw_path, errors="replace") as f:
+        speeds, samples = parse_raw(f)
+    os.remove(raw_path)
+    if len(samples) < 2:
+        return False
+    np.savez_compressed(out_path, **to_rates(speeds, samples))
+    return True
+
+
+def summarize(path, window=None):
+    """
+    Means over the samples inside window (start_ns, end_ns), or all of them.
+    CPU figures are busy fractions; the busiest core and the mean over cores.
+    """
+    with np.load(path) as data:
+        rates = dict(data)
+    keep = np.ones(len(rates["t"]), dtype=bool)
+    if window is not None:
+        inside = (rates["t"] >= window[0]) & (rates["t"] <= window[1])
+        if np.any(inside):
+            keep = inside
+    per_core = rates["cpu_busy"][keep].mean(axis=0)
+    summary = {"cpu_max": float(per_core.max()),
+               "cpu_mean": float(per_core.mean()),
+               "softirq_per_s": float(rates["net_rx_softirq_per_s"][keep].mean() +
+                                      rates["net_tx_softirq_per_s"][keep].mean()),
+               "nic_gbps": None, "nic_util": None, "nic_drops_per_s": None,
+               "membw_gbps": None}
+    if len(rates["nics"]) > 0:
+        nic = rates["nic_per_s"][keep].mean(axis=0)
+        # the busiest direction of the busiest interface
+        bits = np.maximum(nic[:, 0], nic[:, 3]) * 8
+        busiest = int(np.argmax(bits))
+        summary["nic_gbps"] = float(bits[busiest] / 1e9)
+        speed = rates["nic_speed_mbps"][busiest]
+        if speed > 0:
+            summary["nic_util"] = float(bits[busiest] / (speed * 1e6))
+        summary["nic_drops_per_s"] = float(nic[:, 2].sum() + nic[:, 5].sum())
+    if "mbm_bytes_per_s" in rates:
+        summary["membw_gbps"] = float(rates["mbm_bytes_per_s"][keep].mean() * 8 / 1e9)
+    return summary
+
+
+def bottleneck(server, clients, libos=None):
+    """
+    The first saturated resource among the server core, the server NIC and
+    the client cores, or "none". "unknown" for busy-polling libOSes, whose
+    cores always read as busy and whose traffic bypasses the kernel counters.
+    """
+    if libos in BUSY_POLL_LIBOSES:
+        return "unknown"
+    if server is not None and server["cpu_max"] >= CPU_SATURATED:
+        return "server_cpu"
+    if server is not None and server["nic_util"] is not None and \
+            server["nic_util"] >= NIC_SATURATED:
+        return "nic"
+    if any([client["cpu_max"] >= CPU_SATURATED for client in clients]):
+        return "client_cpu"
+    return "none"
+
+
+def host_window(window, clock_offsets, role):
+    """
+    window (harness clock) on role's host clock; unshifted when no offset was
+    recorded (older trials).
+    """
+    if window is None or clock_offsets is None or clock_offsets.get(role) is None:
+        return window
+    offset = clock_offsets[role]
+    return (window[0] + offset, window[1] + offset)
+
+
+def trial_fields(final_path, window=None, clock_offsets=None, libos=None):
+    """
+    TELEMETRY_FIELDS for a trial folder; all None if it has no telemetry.
+    clock_offsets maps each role to its host's clock minus the harness's, in
+    ns, as recorded in experiment.json.
+    """
+    fields = {field: None for field in TELEMETRY_FIELDS}
+    server_file = os.path.join(str(final_path), TELEMETRY.format("server"))
+    client_files = sorted([name for name in os.listdir(str(final_path))
+                           if name.startswith("client") and name.endswith(".telemetry.npz")])
+    if not os.path.exists(server_file) and len(client_files) == 0:
+        return fields
+    server = summarize(server_file, host_window(window, clock_offsets, "server")) \
+        if os.path.exists(server_file) else None
+    clients = [summarize(os.path.join(str(final_path), name),
+                         host_window(window, clock_offsets,
+                                     name[:-len(TELEMETRY.format(""))]))
+               for name in client_files]
+    if server is not None:
+        for key in ["cpu_max", "cpu_mean", "softirq_per_s", "nic_gbps", "nic_util",
+                    "nic_drops_per_s", "membw_gbps"]:
+            fields["server_{}".format(key)] = server[key]
+    if len(clients) > 0:
+        fields["client_cpu_max"] = max([client["cpu_max"] for client in clients])
+    fields["bottleneck"] = bottleneck(server, clients, libos)
+    return fields
@@ -0,0 +1,79 @@
+import numpy as np
+"""
+Windowed time-series view of a client's latency log, and steady-state
+detection on top of it.
+
+A log is cut into consecutive windows of equal sample count. Warm-up and
+cool-down are found with MSER (marginal standard error rule) on the window
+medians: the truncation point is the one that minimizes the standard error of
+the remaining windows' mean, searched over the first half of the series from
+each end.
+"""
+SERIES_WINDOWS = 200  # target number of windows per client log
+MIN_WINDOW = 100  # samples
+
+
+def default_window(num_samples):
+    return max(num_samples // SERIES_WINDOWS, MIN_WINDOW)
+
+
+def window_stats(latencies, send_times=None, window=None):
+    """
+    Per-window median, p99 and mean latency (ns), plus throughput (req/ms)
+    when send timestamps are available. A trailing partial window is dropped.
+    """
+    if window is None:
+        window = default_window(len(latencies))
+    num_windows = len(latencies) // window
+    stats = {"window": window,
+             "start": np.arange(num_windows) * window,
+             "median": np.zeros(0), "p99": np.zeros(0), "mean": np.zeros(0),
+             "tput": None}
+    if num_windows == 0:
+        return stats
+    blocks = np.asarray(latencies[:num_windows * window]).reshape(num_windows, window)
+    median_idx = int(window * 0.50)
+    p99_idx = min(int(window * 0.99), window - 1)
+    partitioned = np.partition(blocks, [median_idx, p99_idx], axis=1)
+    stats["median"] = partitioned[:, median_idx]
+    stats["p99"] = partitioned[:, p99_idx]
+    stats["mean"] = blocks.mean(axis=1)
+    if send_times is not None:
+        sends = np.asarray(send_times[:num_windows * window]).reshape(num_windows, window)
+        spans = (sends + blocks).max(axis=1) - sends.min(axis=1)
+        stats["tput"] = window / (np.maximum(spans, 1) / float(1000000))
+    return stats
+
+
+def mser_truncation(series):
+    """
+    Number of leading points to drop from series so that the standard error
+    of the remaining mean is smallest; at most half the series is dropped.
+    """
+    series = np.asarray(series, dtype=np.float64)
+    n = len(series)
+    if n < 4:
+        return 0
+    # suffix sums give mean and variance of series[d:] for every d at once
+    suffix = np.cumsum(series[::-1])[::-1]
+    suffix_sq = np.cumsum((series ** 2)[::-1])[::-1]
+    remaining = np.arange(n, 0, -1, dtype=np.float64)
+    sse = suffix_sq - suffix ** 2 / remaining
+    mser = sse / remaining ** 2
+    return int(np.argmin(mser[:n // 2 + 1]))
+
+
+def steady_state_bounds(latencies, window=None):
+    """
+    Returns the [start, end) sample range of the log's steady state.
+    """
+    stats = window_stats(latencies, window=window)
+    num_windows = len(stats["median"])
+    if num_windows < 4:
+        return 0, len(latencies)
+    start_windows = mser_truncation(stats["median"])
+    end_windows = mser_truncation(stats["median"][start_windows:][::-1])
+    start = start_windows * stats["window"]
+    end = len(latencies) if end_windows == 0 else \
+        (num_windows - end_windows) * stats["window"]
+    return start, end
@@ -0,0 +1,9 @@
+"""
+Code shared by the echo and kv harnesses.
+
+echo/harness and kv/harness are symlinks to this folder, so scripts run from
+either experiment folder import it as the harness package (e.g.
+`from harness.analysis import walk_trials`) without touching sys.path, and
+each experiment's own common.py and parse_data.py stay unambiguous. Modules
+in here must not import either experiment's modules.
+"""
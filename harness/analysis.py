@@ -0,0 +1,103 @@
+import multiprocessing as mp
+import os
+from pathlib import Path
+"""
+Process-parallel analysis engine shared by echo/parse_data.py and
+kv/parse_data.py.
+
+A sweep writes one folder per trial, <logfile>/<level>/.../trial_<n>, where
+the levels are given by the caller's layout: a list of (field, converter)
+pairs, one per directory level, e.g. [("system", str), ("workload", str),
+("num_clients", clients_from_name)]. A level whose name encodes several
+fields uses a tuple of fields and a converter returning a tuple. walk_trials turns the tree into one job
+per trial folder, and parse_trials runs a module-level per-trial parser over
+the jobs in a process pool. Workers return structured records; only the
+calling process writes output files or databases.
+
+It is part of the shared harness package, so it must not import either
+experiment's common.py.
+"""
+# plot output, trial folders set aside by a resumed sweep (journal.py), and
+# the levels of saturation searches (echo/common.py's SEARCH_FOLDER)
+SKIP_FOLDERS = ["plots", "requeued", "search"]
+# warm-up and cool-down fraction dropped from each end of a client's latency log
+STRIP_PERCENT = .03
+
+
+def get_suffix(arg):
+    try:
+        return arg.split("_")[1]
+    except:
+        print(arg)
+        exit(1)
+
+
+def size_from_name(name):
+    return int(get_suffix(name))
+
+
+def clients_from_name(name):
+    # folder names are "<n>clients[_suffix]"; n can have any number of digits
+    return int(name.partition("clients")[0])
+
+
+def walk_trials(logfile, layout, filters=None):
+    """
+    Returns a dict per trial folder with the layout's fields, "trial" and
+    "path". filters maps a field to the values to keep; a missing or empty
+    entry keeps everything.
+    """
+    if filters is None:
+        filters = {}
+    trials = []
+
+    def walk(path, depth, fields):
+        if depth == len(layout):
+            for trial_name in os.listdir(path):
+                if not os.path.isdir(path / trial_name):
+                    continue
+                trial = dict(fields)
+                trial["trial"] = int(get_suffix(trial_name))
+                trial["path"] = path / trial_name
+                trials.append(trial)
+            return
+        field, convert = layout[depth]
+        for name in os.listdir(path):
+            if not os.path.isdir(path / name) or name in SKIP_FOLDERS:
+                continue # extra files stored in directory
+            if isinstance(field, tuple):
+                values = dict(zip(field, convert(name)))
+            else:
+                values = {field: convert(name)}
+            if any([len(filters.get(key) or []) > 0 and value not in filters[key]
+                    for (key, value) in values.items()]):
+                continue
+            walk(path / name, depth + 1, dict(fields, **values))
+
+    walk(Path(logfile), 0, {})
+    return trials
+
+
+def parse_trials(parse_fn, jobs, processes=None):
+    """
+    Runs parse_fn(*job) for every job in a process pool and returns the
+    results in job order. parse_fn must be a module-level function.
+    """
+    if len(jobs) == 0:
+        return []
+    if processes is None:
+        processes = mp.cpu_count()
+    processes = min(processes, len(jobs))
+    if processes == 1:
+        return [parse_fn(*job) for job in jobs]
+    with mp.Pool(processes) as pool:
+        return pool.starmap(parse_fn, jobs)
+
+
+def trial_jobs(trials, fields, *extra):
+    """
+    Turns walk_trials output into parse_trials jobs: the trial path, then the
+    named fields in order, then any extra arguments shared by every job.
+    """
+    return [[trial["path"]] + [trial[field] for field in fields] + list(extra)
+            for trial in trials]
@@ -0,0 +1,34 @@
+import re
+from invoke import Context
+"""
+Local execution backend for echo/common.py and kv/common.py.
+
+Every command of a sweep goes through remote_sudo. When its host is one of
+LOCAL_HOSTS, remote_sudo runs it here as a local shell subprocess instead of
+over a pooled ssh connection. invoke is the library fabric runs commands with,
+so the result has the same ok/exited/stdout/stderr as a remote one and
+hide/warn mean the same thing. With every host in the yaml set to localhost
+and exec_dir pointing at the stand-in programs from emulate.py, a whole
+sweep (scheduling, cleanup, parsing) runs on one machine.
+
+sudo is stripped from local commands so they never stop at a password
+prompt; `nice -n -20` then only warns and runs the command at normal
+priority.
+
+Like the rest of the harness package, it must not import either
+experiment's common.py.
+"""
+LOCAL_HOSTS = ["localhost", "127.0.0.1", "::1"]
+SUDO = re.compile(r"(^|[\s;&|`(])sudo\s+")
+
+
+def is_local(host):
+    return host in LOCAL_HOSTS
+
+
+def local_cmd(cmd):
+    return SUDO.sub(r"\1", cmd)
+
+
+def run_local(cmd, **kwargs):
+    return Context().run(local_cmd(cmd), **kwargs)
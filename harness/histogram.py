@@ -0,0 +1,145 @@
+import numpy as np
+"""
+Mergeable log-linear latency histogram (HDR-style).
+
+Values below 2^precision ns are counted exactly; above that, every power-of-two
+range is split into 2^(precision - 1) equal-width buckets, so any value read
+back out of the histogram is within 2^-precision of the recorded sample. The
+bucket layout depends only on the precision, so histograms from different
+clients, trials, or sweeps add together bucket-for-bucket.
+"""
+DEFAULT_PRECISION = 8
+
+
+def bucket_indices(values, precision):
+    values = np.asarray(values, dtype=np.int64)
+    half = 1 << (precision - 1)
+    # frexp's exponent is the bit length for integers below 2^53
+    shifts = np.frexp(values.astype(np.float64))[1].astype(np.int64) - precision
+    shifts = np.maximum(shifts, 0)
+    return np.where(shifts == 0, values, shifts * half + (values >> shifts))
+
+
+def bucket_bounds(indices, precision):
+    """
+    Returns the (low, high) inclusive value range covered by each bucket index.
+    """
+    indices = np.asarray(indices, dtype=np.int64)
+    half = 1 << (precision - 1)
+    shifts = np.maximum(indices // half - 1, 0)
+    subs = indices - shifts * half
+    low = subs << shifts
+    high = ((subs + 1) << shifts) - 1
+    return low, high
+
+
+class LatencyHistogram(object):
+    def __init__(self, precision=DEFAULT_PRECISION):
+        self.precision = precision
+        self.counts = np.zeros(1 << precision, dtype=np.int64)
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    @classmethod
+    def from_latencies(cls, latencies, precision=DEFAULT_PRECISION):
+        hist = cls(precision)
+        hist.record(latencies)
+        return hist
+
+    def record(self, latencies):
+        latencies = np.asarray(latencies, dtype=np.int64)
+        if len(latencies) == 0:
+            return
+        indices = bucket_indices(latencies, self.precision)
+        counts = np.bincount(indices)
+        self._grow(len(counts))
+        self.counts[:len(counts)] += counts
+        self.count += len(latencies)
+        self.total += int(np.sum(latencies))
+        lmin = int(np.min(latencies))
+        lmax = int(np.max(latencies))
+        self.min = lmin if self.min is None else min(self.min, lmin)
+        self.max = lmax if self.max is None else max(self.max, lmax)
+
+    def _grow(self, length):
+        if length > len(self.counts):
+            self.counts = np.concatenate(
+                [self.counts, np.zeros(length - len(self.counts), dtype=np.int64)])
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge histograms with precision {} and {}".format(
+                self.precision, other.precision))
+        if other.count == 0:
+            return self
+        self._grow(len(other.counts))
+        self.counts[:len(other.counts)] += other.counts
+        self.count += other.count
+        self.total += other.total
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+        return self
+
+    def __iadd__(self, other):
+        return self.merge(other)
+
+    def __add__(self, other):
+        return LatencyHistogram(self.precision).merge(self).merge(other)
+
+    def __len__(self):
+        return self.count
+
+    def mean(self):
+        if self.count == 0:
+            return float("nan")
+        return self.total / float(self.count)
+
+    def quantile(self, quantile):
+        """
+        Value at rank int(count * quantile), i.e. the same sample the old
+        sorted-list helpers picked, up to the histogram's relative error.
+        """
+        if self.count == 0:
+            return float("nan")
+        rank = min(int(self.count * quantile), self.count - 1)
+        idx = int(np.searchsorted(np.cumsum(self.counts), rank, side="right"))
+        low, high = bucket_bounds(idx, self.precision)
+        value = (int(low) + int(high)) / 2.0
+        return min(max(value, self.min), self.max)
+
+    def summary(self):
+        """
+        Returns the standard quantiles and the mean in ns.
+        """
+        return {"median": self.quantile(0.50),
+                "p99": self.quantile(0.99),
+                "p999": self.quantile(0.999),
+                "p9999": self.quantile(0.9999),
+                "avg": self.mean()}
+
+    def to_dict(self):
+        """
+        Sparse, JSON-serializable form of the histogram (for parse caches).
+        """
+        nonzero = np.nonzero(self.counts)[0]
+        return {"precision": self.precision,
+                "indices": nonzero.tolist(),
+                "counts": self.counts[nonzero].tolist(),
+                "count": self.count,
+                "total": self.total,
+                "min": self.min,
+                "max": self.max}
+
+    @classmethod
+    def from_dict(cls, data):
+        hist = cls(data["precision"])
+        if len(data["indices"]) > 0:
+            hist._grow(max(data["indices"]) + 1)
+            hist.counts[data["indices"]] = data["counts"]
+        hist.count = data["count"]
+        hist.total = data["total"]
+        hist.min = data["min"]
+        hist.max = data["max"]
+        return hist
@@ -0,0 +1,223 @@
+import argparse
+import mmap
+import multiprocessing as mp
+import os
+import struct
+import sys
+import numpy as np
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+"""
+Compact binary format for clientN.latencies.log files.
+
+Layout: a 24-byte header (magic, flags, records per block, total records)
+followed by independently decodable blocks. Each block is an 8-byte header
+(records, payload bytes) and a payload of LEB128 varints: the send-timestamp
+deltas first (timestamped logs only; the first delta of a block is from 0),
+then the latencies. Latencies are stored as plain varints rather than deltas,
+since consecutive latencies are uncorrelated and their differences are no
+smaller. With FLAG_ZSTD, each payload is a zstd frame.
+
+Because blocks are self-contained, the reader mmaps the file and decodes one
+block at a time. Converted files keep their .latencies.log name;
+parse_data.parse_latency_log tells the formats apart by the magic bytes.
+
+Usage:
+    python -m harness.latlog -l <logfolder> [--zstd]
+converts every text latency log under logfolder in place.
+"""
+MAGIC = b"LATLOG\x00\x01"
+HEADER = struct.Struct("<8sB3xIQ")
+BLOCK_HEADER = struct.Struct("<II")
+FLAG_TIMESTAMPS = 0x1
+FLAG_ZSTD = 0x2
+BLOCK_RECORDS = 1 << 16
+LATENCY_LOG_SUFFIX = ".latencies.log"
+
+
+def encode_varints(values):
+    values = np.asarray(values).astype(np.uint64)
+    if len(values) == 0:
+        return b""
+    nbytes = np.ones(len(values), dtype=np.int64)
+    rest = values >> np.uint64(7)
+    while np.any(rest):
+        nbytes += rest > 0
+        rest >>= np.uint64(7)
+    starts = np.cumsum(nbytes) - nbytes
+    owner = np.repeat(np.arange(len(values)), nbytes)
+    pos = np.arange(int(nbytes.sum())) - starts[owner]
+    out = ((values[owner] >> (pos * 7).astype(np.uint64)) & np.uint64(0x7f)).astype(np.uint8)
+    out[pos < nbytes[owner] - 1] |= 0x80
+    return out.tobytes()
+
+
+def decode_varints(buf):
+    raw = np.frombuffer(buf, dtype=np.uint8)
+    if len(raw) == 0:
+        return np.zeros(0, dtype=np.uint64)
+    ends = np.nonzero(raw < 0x80)[0]
+    starts = np.concatenate([[0], ends[:-1] + 1])
+    pos = np.arange(len(raw)) - np.repeat(starts, ends - starts + 1)
+    parts = (raw & 0x7f).astype(np.uint64) << (pos * 7).astype(np.uint64)
+    return np.add.reduceat(parts, starts)
+
+
+def is_binary_log(path):
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def read_text_log(path):
+    """
+    Reads a text latency log: one latency per line, or a send timestamp and a
+    latency per line. Returns (latencies, send_times or None).
+    """
+    with open(path) as f:
+        columns = len(f.readline().split())
+    values = np.fromfile(path, dtype=np.int64, sep=" ")
+    if columns == 2:
+        # drop a trailing half-written line
+        values = values[:len(values) // 2 * 2].reshape(-1, 2)
+        return values[:, 1].copy(), values[:, 0].copy()
+    return values, None
+
+
+def write_latlog(path, latencies, send_times=None, compress=False,
+                 block_records=BLOCK_RECORDS):
+    if compress and zstandard is None:
+        raise RuntimeError("zstd-framed latency logs need the zstandard package")
+    flags = (FLAG_TIMESTAMPS if send_times is not None else 0) | \
+        (FLAG_ZSTD if compress else 0)
+    compressor = zstandard.ZstdCompressor() if compress else None
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, flags, block_records, len(latencies)))
+        for start in range(0, len(latencies), block_records):
+            end = min(start + block_records, len(latencies))
+            payload = b""
+            if send_times is not None:
+                sends = np.asarray(send_times[start:end], dtype=np.int64)
+                payload += encode_varints(np.diff(sends, prepend=0))
+            payload += encode_varints(latencies[start:end])
+            if compressor is not None:
+                payload = compressor.compress(payload)
+            f.write(BLOCK_HEADER.pack(end - start, len(payload)))
+            f.write(payload)
+
+
+def iter_blocks(path):
+    """
+    Streams (latencies, send_times or None) one block at a time from a
+    binary latency log, decoding straight out of an mmap of the file.
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size <= HEADER.size:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            magic, flags, _, count = HEADER.unpack_from(mapped, 0)
+            if magic != MAGIC:
+                raise ValueError("{} is not a binary latency log".format(path))
+            if flags & FLAG_ZSTD and zstandard is None:
+                raise RuntimeError("{} is zstd-framed; install zstandard".format(path))
+            decompressor = zstandard.ZstdDecompressor() if flags & FLAG_ZSTD else None
+            offset = HEADER.size
+            while offset + BLOCK_HEADER.size <= len(mapped):
+                records, length = BLOCK_HEADER.unpack_from(mapped, offset)
+                offset += BLOCK_HEADER.size
+                payload = mapped[offset:offset + length]
+                offset += length
+                if decompressor is not None:
+                    payload = decompressor.decompress(payload)
+                values = decode_varints(payload).astype(np.int64)
+                if flags & FLAG_TIMESTAMPS:
+                    yield values[records:], np.cumsum(values[:records])
+                else:
+                    yield values, None
+
+
+def read_latlog(path):
+    latencies = []
+    send_times = []
+    timestamped = False
+    for (block_latencies, block_sends) in iter_blocks(path):
+        latencies.append(block_latencies)
+        if block_sends is not None:
+            timestamped = True
+            send_times.append(block_sends)
+    if len(latencies) == 0:
+        return np.empty(0, dtype=np.int64), None
+    return np.concatenate(latencies), \
+        (np.concatenate(send_times) if timestamped else None)
+
+
+def read_any_log(path):
+    """
+    Reads a latency log in either format; returns (latencies, send_times or None).
+    """
+    if is_binary_log(path):
+        return read_latlog(path)
+    return read_text_log(path)
+
+
+def count_records(path):
+    """
+    Number of records in a latency log of either format, without decoding it.
+    """
+    if is_binary_log(path):
+        with open(path, "rb") as f:
+            header = f.read(HEADER.size)
+        return HEADER.unpack(header)[3] if len(header) == HEADER.size else 0
+    count = 0
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            count += chunk.count(b"\n")
+    return count
+
+
+def convert_log(path, compress=False):
+    """
+    Rewrites a text latency log in the binary format, in place. Returns the
+    (text, binary) sizes in bytes, or None if it was already binary.
+    """
+    if is_binary_log(path):
+        return None
+    latencies, send_times = read_text_log(path)
+    tmp_path = "{}.tmp".format(path)
+    write_latlog(tmp_path, latencies, send_times, compress)
+    text_size = os.path.getsize(path)
+    os.replace(tmp_path, path)
+    return text_size, os.path.getsize(path)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-l", "--logfile",
+                        help = "Base logfile; every latency log under it is converted",
+                        required = True)
+    parser.add_argument("-z", "--zstd",
+                        help = "zstd-compress each block",
+                        action = "store_true")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    paths = []
+    for (root, _, files) in os.walk(args.logfile):
+        for name in files:
+            if name.endswith(LATENCY_LOG_SUFFIX):
+                paths.append(os.path.join(root, name))
+    pool = mp.Pool(mp.cpu_count())
+    sizes = [size for size in
+             pool.starmap(convert_log, [(path, args.zstd) for path in paths])
+             if size is not None]
+    text_total = sum([text for (text, _) in sizes])
+    binary_total = sum([binary for (_, binary) in sizes])
+    print("Converted {} logs: {} -> {} bytes".format(
+        len(sizes), text_total, binary_total), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
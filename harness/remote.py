@@ -0,0 +1,297 @@
+import asyncio
+import functools
+import shlex
+import sys
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from fabric import Connection
+from paramiko.ssh_exception import SSHException
+from harness.executor import is_local, run_local
+"""
+Remote execution helpers shared by echo/common.py and kv/common.py.
+
+Both experiments drive the same kind of testbed, one server host and a set of
+client hosts from the yaml's hosts section, over one pooled ssh connection
+per (host, user). The helpers here only rely on the yaml keys both harnesses
+have (user, key, libos, port, hosts.server.addr, server_ready_marker); which
+binaries to start and how to kill them stays in each common.py.
+"""
+KEEPALIVE_INTERVAL = 30  # seconds, keeps pooled ssh connections from idling out
+POLL_INTERVAL = 0.2  # seconds between readiness/termination checks
+SERVER_READY_TIMEOUT = 30
+SERVER_START_SLEEP = 3  # used when there is no way to detect readiness
+SERVER_EXIT_TIMEOUT = 10
+CLIENT_EXIT_TIMEOUT = 5
+CLIENT_TIMEOUT = 600  # per-client deadline, override with client_timeout in the yaml
+
+
+def debug(*args):
+    prepend = "\u2192"
+    print(prepend, *args, file=sys.stderr)
+
+
+# wall-clock seconds and number of waits spent in each phase of the sweep
+PHASE_TIMES = {}
+PHASE_TIMES_LOCK = threading.Lock()
+
+
+class timed_phase(object):
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.time()
+
+    def __exit__(self, *exc):
+        with PHASE_TIMES_LOCK:
+            elapsed, count = PHASE_TIMES.get(self.name, (0.0, 0))
+            PHASE_TIMES[self.name] = (elapsed + time.time() - self.start,
+                                      count + 1)
+
+
+def report_phase_times():
+    for name in sorted(PHASE_TIMES):
+        elapsed, count = PHASE_TIMES[name]
+        debug("Phase {}: {:.1f} s total over {} waits ({:.2f} s avg)".format(
+            name, elapsed, count, elapsed / count))
+
+
+def poll_until(check, timeout, interval=POLL_INTERVAL):
+    """
+    Calls check() every interval seconds until it returns True or timeout
+    seconds have passed; returns whether check succeeded.
+    """
+    deadline = time.time() + timeout
+    while True:
+        if check():
+            return True
+        if time.time() >= deadline:
+            return False
+        time.sleep(interval)
+
+
+# one ssh connection per (host, user), shared by every helper for the sweep
+CONNECTIONS = {}
+CONNECTIONS_LOCK = threading.Lock()
+# one lock per connection, so handshakes with different hosts run concurrently
+OPEN_LOCKS = {}
+
+
+def connection(args, host):
+    key = (host, args["user"])
+    with CONNECTIONS_LOCK:
+        if key not in CONNECTIONS:
+            CONNECTIONS[key] = Connection(host=host,
+                                          user=args["user"],
+                                          port=22,
+                                          connect_kwargs={"key_filename": args["key"]})
+        return CONNECTIONS[key]
+
+
+def open_lock(args, host):
+    with CONNECTIONS_LOCK:
+        return OPEN_LOCKS.setdefault((host, args["user"]), threading.Lock())
+
+
+def drop_connection(args, host):
+    with CONNECTIONS_LOCK:
+        cxn = CONNECTIONS.pop((host, args["user"]), None)
+    if cxn is not None:
+        try:
+            cxn.close()
+        except Exception:
+            pass
+
+
+def close_connections():
+    with CONNECTIONS_LOCK:
+        cxns = list(CONNECTIONS.values())
+        CONNECTIONS.clear()
+    for cxn in cxns:
+        try:
+            cxn.close()
+        except Exception:
+            pass
+
+
+def open_connection(args, host):
+    """
+    The pooled connection to host, opened. Fabric reopens connections whose
+    transport has closed; if opening fails anyway (e.g. on a dropped TCP
+    session), the connection is replaced and opened once more.
+    """
+    def attempt():
+        cxn = connection(args, host)
+        cxn.open()
+        cxn.transport.set_keepalive(KEEPALIVE_INTERVAL)
+        return cxn
+    with open_lock(args, host):
+        try:
+            return attempt()
+        except (SSHException, EOFError, socket.error) as e:
+            debug("Connection to {} is stale ({}), reconnecting".format(host, e))
+            drop_connection(args, host)
+            return attempt()
+
+
+def remote_sudo(args, host, cmd, **kwargs):
+    """
+    Runs cmd with sudo on host over the pooled connection. Only opening the
+    connection is retried: a command that fails partway is never rerun,
+    since it may have been a benchmark that already wrote its logs; the
+    error goes to the caller. Commands for a local host run as local
+    subprocesses instead (see executor.py).
+    """
+    if is_local(host):
+        return run_local(cmd, **kwargs)
+    return open_connection(args, host).sudo(cmd, **kwargs)
+
+
+def remote_check(args, host, cmd):
+    try:
+        return remote_sudo(args, host, cmd, hide=True, warn=True).ok
+    except Exception:
+        return False
+
+
+def process_running(args, host, binary):
+    # the bracket keeps pgrep from matching the shell running the check
+    pattern = "[{}]{}".format(binary[0], binary[1:])
+    return remote_check(args, host, "pgrep -f {}".format(shlex.quote(pattern)))
+
+
+def wait_for_exit(args, host, binary, timeout):
+    return poll_until(lambda: not process_running(args, host, binary), timeout)
+
+
+def wait_for_server(args, logpath):
+    """
+    Waits until the server is ready to take requests: its log contains the
+    yaml's server_ready_marker if one is set, otherwise (dmtr-posix only) its
+    port shows up in ss. Without either there is nothing to poll, so this
+    falls back to a fixed sleep.
+    """
+    host = args["hosts"]["server"]["addr"]
+    marker = args.get("server_ready_marker")
+    if marker is not None:
+        cmd = "grep -qF {} {}".format(shlex.quote(marker), shlex.quote(logpath))
+    elif args["libos"] == "dmtr-posix":
+        cmd = "ss -Hlntu | grep -q ':{}\\b'".format(args["port"])
+    else:
+        time.sleep(SERVER_START_SLEEP)
+        return True
+    if not poll_until(lambda: remote_check(args, host, cmd), SERVER_READY_TIMEOUT):
+        debug("Server not ready after {} s, starting clients anyway".format(
+            SERVER_READY_TIMEOUT))
+        return False
+    return True
+
+
+def run_cmd(cmd, host, args, fail_ok=False):
+    try:
+        res = remote_sudo(args, host, cmd, hide=True)
+        res.stdout.strip()
+        return
+    except:
+        if not fail_ok:
+            debug("Failed to run cmd {} on host {}.".format(cmd, host))
+
+        return
+
+
+def run_remote(args, host, cmd, role):
+    """
+    Runs cmd on host and returns a result dict with its exit status and
+    output; unlike run_cmd, failures are recorded rather than swallowed.
+    """
+    result = {"role": role, "host": host, "cmd": cmd, "exit_code": None,
+              "stdout": "", "stderr": "", "error": None, "timed_out": False,
+              "duration": None}
+    start = time.time()
+    try:
+        res = remote_sudo(args, host, cmd, hide=True, warn=True)
+        result["exit_code"] = res.exited
+        result["stdout"] = res.stdout
+        result["stderr"] = res.stderr
+    except Exception as e:
+        result["error"] = repr(e)
+    result["duration"] = time.time() - start
+    return result
+
+
+async def run_remote_async(loop, executor, args, host, cmd, role,
+                           deadline=None, on_timeout=None):
+    """
+    Awaits run_remote in the executor. If it outlives deadline seconds,
+    on_timeout (e.g. a kill helper) is run so the remote command returns, and
+    the result is marked as timed out.
+    """
+    future = loop.run_in_executor(executor, run_remote, args, host, cmd, role)
+    try:
+        return await asyncio.wait_for(asyncio.shield(future), deadline)
+    except asyncio.TimeoutError:
+        debug("{} on {} missed its {} s deadline".format(role, host, deadline))
+        if on_timeout is not None:
+            await loop.run_in_executor(executor, on_timeout)
+        try:
+            result = await asyncio.wait_for(future, CLIENT_EXIT_TIMEOUT)
+        except asyncio.TimeoutError:
+            result = {"role": role, "host": host, "cmd": cmd, "exit_code": None,
+                      "stdout": "", "stderr": "", "duration": None,
+                      "error": "still running after kill"}
+        result["timed_out"] = True
+        return result
+
+
+async def orchestrate(args, server, clients, server_log, kill_server,
+                      kill_client):
+    """
+    Starts the server, waits for it to be ready, runs every client
+    concurrently with a per-client deadline, then kills the server.
+    server is a (host, cmd) pair and clients a list of (idx, host, cmd);
+    kill_server(args) and kill_client(args, idx) are the experiment's own
+    kill helpers. Returns the structured result for the experiment.
+    """
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=len(clients) + 2)
+    deadline = args.get("client_timeout", CLIENT_TIMEOUT)
+    experiment = {"server": None, "clients": [], "ok": False}
+    try:
+        server_future = loop.run_in_executor(
+            executor, run_remote, args, server[0], server[1], "server")
+        with timed_phase("server_ready"):
+            await loop.run_in_executor(executor, wait_for_server, args, server_log)
+        if server_future.done():
+            experiment["server"] = server_future.result()
+            debug("Server exited before clients started: {}".format(
+                experiment["server"]))
+            return experiment
+
+        # wall-clock window of the measurement, for host telemetry
+        experiment["clients_start_ns"] = time.time_ns()
+        with timed_phase("clients_run"):
+            experiment["clients"] = await asyncio.gather(*[
+                run_remote_async(loop, executor, args, host, cmd,
+                                 "client{}".format(idx), deadline,
+                                 functools.partial(kill_client, args, idx))
+                for (idx, host, cmd) in clients])
+        experiment["clients_end_ns"] = time.time_ns()
+        await loop.run_in_executor(executor, kill_server, args)
+        try:
+            experiment["server"] = await asyncio.wait_for(
+                server_future, SERVER_EXIT_TIMEOUT)
+        except asyncio.TimeoutError:
+            debug("Server command still running after kill")
+    finally:
+        executor.shutdown(wait=False)
+
+    experiment["ok"] = all([client["exit_code"] == 0 and not client["timed_out"]
+                            for client in experiment["clients"]])
+    for client in experiment["clients"]:
+        if client["exit_code"] != 0 or client["timed_out"]:
+            debug("Failed {} on host {}: exit code {}, error {}, stderr {}".format(
+                client["role"], client["host"], client["exit_code"],
+                client["error"], client["stderr"].strip()))
+    return experiment
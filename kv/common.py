@@ -1,19 +1,17 @@
 import argparse
+import asyncio
+import json
 import os
-import sys
-import multiprocessing
-from fabric import Connection
+import threading
 import yaml
-import time
+# the remote execution helpers are shared with echo/common.py
+from harness.remote import debug, timed_phase, report_phase_times, close_connections, remote_sudo, wait_for_exit, run_cmd, orchestrate, SERVER_EXIT_TIMEOUT, CLIENT_EXIT_TIMEOUT
 #########
 WORKLOADS = ["workloada", "workloadb", "workloadc"]
 NUM_TRIALS = 5
+EXPERIMENT_RESULT = "experiment.json"
 #########
 
-def debug(*args):
-    prepend = "\u2192"
-    print(prepend, *args, file=sys.stderr)
-
 def get_parser():
     parser = argparse.ArgumentParser()
     parser.add_argument("-y", "--yaml",
@@ -58,46 +56,45 @@ def calculate_log_path(args, trial, workload, exp):
             exp,
             trial)
 
-def connection(args, host):
-    cxn = Connection(host = host,
-                        user = args["user"],
-                        port = 22,
-                        connect_kwargs = {"key_filename": args["key"]})
-    return cxn
-
-
-
 # kill any rogue processes on server
 def cleanup(args):
     kill_server(args)
-    for idx in range(1, args["num_clients"] + 1):
-        kill_client(args, idx)
+    # client hosts are independent, so wait for them in parallel
+    killers = [threading.Thread(target = kill_client, args = (args, idx))
+                for idx in range(1, args["num_clients"] + 1)]
+    for killer in killers:
+        killer.start()
+    for killer in killers:
+        killer.join()
     debug("Done with cleanup, starting experiment.")
 
 
 def kill_server(args):
     host = args["hosts"]["server"]["addr"]
-    cxn = connection(args, host)
-    try:
-        # send 2 -> interrupt from keyboard
-        cxn.sudo("sudo kill -9 `ps aux | grep {kv_exec_dir}/{libos}-kv-server | awk '{{print $2}}' | head -n3`".format(**args), hide = True)
-        time.sleep(10)
-        debug("Killed server")
-        return
-    except:
+    binary = "{kv_exec_dir}/{libos}-kv-server".format(**args)
+    with timed_phase("server_exit"):
+        try:
+            # send 2 -> interrupt from keyboard
+            remote_sudo(args, host, "sudo kill -9 `ps aux | grep {} | awk '{{print $2}}' | head -n3`".format(binary), hide = True)
+        except:
+            pass
+        if wait_for_exit(args, host, binary, SERVER_EXIT_TIMEOUT):
+            debug("Killed server")
+            return True
         return False
 
 def kill_client(args, idx):
     host = args["hosts"]["client{}".format(idx)]["addr"]
-    cxn = connection(args, host)
-    try:
-        # send 2 -> interrupt from keyboard
-        cxn.sudo("sudo kill  -9 `ps aux | grep {kv_exec_dir}/{libos}-kv-client | awk '{{print $2}}' | head -n3`".format(**args), hide = True)
-        time.sleep(2)
-    except:
-        return False
-
-def start_server(args, trial, workload, num_clients):
+    binary = "{kv_exec_dir}/{libos}-kv-client".format(**args)
+    with timed_phase("client_exit"):
+        try:
+            # send 2 -> interrupt from keyboard
+            remote_sudo(args, host, "sudo kill  -9 `ps aux | grep {} | awk '{{print $2}}' | head -n3`".format(binary), hide = True)
+        except:
+            pass
+        return wait_for_exit(args, host, binary, CLIENT_EXIT_TIMEOUT)
+
+def server_cmd(args, trial, workload, num_clients):
     exp = "{}clients".format(num_clients)
     baselog = calculate_log_path(args, trial, workload, exp)
     if not args["pprint"]:
@@ -117,13 +114,17 @@ def start_server(args, trial, workload, num_clients):
                 "{}.err.log".format(logpath))
 
     host = args["hosts"]["server"]["addr"]
+    return host, cmd
+
+def start_server(args, trial, workload, num_clients):
+    host, cmd = server_cmd(args, trial, workload, num_clients)
     if args["pprint"]:
         debug(host, ": ", cmd)
 
-    proc = multiprocessing.Process(target = run_cmd, args=(cmd, host, args, True))
+    proc = threading.Thread(target = run_cmd, args=(cmd, host, args, True))
     return proc
 
-def start_client(args, idx, trial, workload, num_clients):
+def client_cmd(args, idx, trial, workload, num_clients):
     exp = "{}clients".format(num_clients)
     baselog = calculate_log_path(args, trial, workload, exp)
     logpath  = "{}/client{}".format(baselog, idx)
@@ -137,27 +138,22 @@ def start_client(args, idx, trial, workload, num_clients):
     if (args["system"] == "protobuf"):
         # for protobuf, need a larger timeout for retries
         cmd += " --timeout 4000000"
+    # record all the latencies
+    cmd += " --latlog {}.latencies.log".format(logpath)
     cmd += " > {} 2> {}".format(
                 "{}.log".format(logpath),
                 "{}.err.log".format(logpath))
 
     host = args["hosts"]["client{}".format(idx)]["addr"]
+    return host, cmd
+
+def start_client(args, idx, trial, workload, num_clients):
+    host, cmd = client_cmd(args, idx, trial, workload, num_clients)
     if args["pprint"]:
         debug(host, ": ", cmd)
-    proc = multiprocessing.Process(target = run_cmd, args=(cmd, host, args))
+    proc = threading.Thread(target = run_cmd, args=(cmd, host, args))
     return proc
 
-def run_cmd(cmd, host, args, fail_ok = False):
-    cxn = connection(args, host)
-    try:
-        res = cxn.sudo(cmd, hide = True)
-        res.stdout.strip()
-        return
-    except:
-        if not fail_ok: 
-            debug("Failed to run cmd {} on host {}.".format(cmd, host))
-        return
-
 def run_exp(args, trial, workload, num_clients):
     exp = "{}clients".format(num_clients)
     if os.path.exists(calculate_log_path(args, trial, workload, exp)):
@@ -171,38 +167,36 @@ def run_exp(args, trial, workload, num_clients):
             workload,
             args["system"],
             num_clients))
-    server_proc = start_server(args, trial, workload, num_clients)
-    if not args["pprint"]:
-        print("Starting server!")
-        server_proc.start()
-        time.sleep(3)
-    # start each client
-    client_procs = []
+    server = server_cmd(args, trial, workload, num_clients)
+    clients = []
     for i in range(1, num_clients + 1):
-        client_procs.append(start_client(args, i, trial, workload, num_clients))
-    
+        host, cmd = client_cmd(args, i, trial, workload, num_clients)
+        clients.append((i, host, cmd))
+
     if args["pprint"]:
+        for (host, cmd) in [server] + [(host, cmd) for (_, host, cmd) in clients]:
+            debug(host, ": ", cmd)
         return
 
-    # start and join each client, then kill server
-    for proc in client_procs:
-        proc.start()
-    for proc in client_procs:
-        proc.join()
-        debug("\t Client joined")
-
-    kill_server(args)
-    return
+    print("Starting server!")
+    logpath = calculate_log_path(args, trial, workload, exp)
+    experiment = asyncio.run(orchestrate(
+                    args, server, clients, "{}/server.log".format(logpath),
+                    kill_server, kill_client))
+    with open("{}/{}".format(logpath, EXPERIMENT_RESULT), "w") as f:
+        json.dump(experiment, f, indent = 2)
+    return experiment
 
 def cycle_exps(args):
     for trial in range(0, NUM_TRIALS):
         for workload in WORKLOADS:
             for clients in range(1, args["num_clients"] + 1):
                 run_exp(args, trial, workload, clients)
+    report_phase_times()
 
 def parse_params(args):
     with open(args.yaml) as f:
-        data = yaml.load(f)
+        data = yaml.safe_load(f)
     data["libos"] = args.libos # lwip, rdma, posix
     data["system"] = args.system # currently: baseline, protobuf
     data["num_clients"] = args.num_clients # number of available clients to
@@ -220,6 +214,7 @@ def main():
     # run cleanup
     cleanup(config)
     cycle_exps(config)
+    close_connections()
 
 if __name__ == '__main__':
     main()
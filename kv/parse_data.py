@@ -5,6 +5,14 @@ import sys
 import argparse
 import parse
 from common import debug
+# the trial walker and process pool are shared with echo/parse_data.py
+from harness.analysis import STRIP_PERCENT, walk_trials, parse_trials, trial_jobs, clients_from_name
+from harness.histogram import LatencyHistogram
+from harness.latlog import read_any_log
+
+CSV_FIELDS = ["system", "workload", "num_clients", "median", "avg", "p99",
+              "tput", "retries", "p999", "p9999", "latency_source"]
+LAYOUT = [("system", str), ("workload", str), ("num_clients", clients_from_name)]
 
 def convert_tput(tput, size):
     return tput * 1000 * size * 8 / 1000000000
@@ -84,9 +92,34 @@ def parse_log(logfile):
     return latency
 
 
-def parse_folder(f, final_path, system, workload, trial, num_clients):
+def merged_histogram(final_path, num_clients):
+    """
+    LatencyHistogram of every client's per-request latencies (ns) from its
+    clientN.latencies.log, with STRIP_PERCENT dropped from each end of every
+    log as in echo/parse_data.py; None if any client did not write one (older
+    trials). Only one client's samples are in memory at a time.
+    """
+    hist = LatencyHistogram()
+    for i in range(1, num_clients + 1):
+        latencies_log = "{}/client{}.latencies.log".format(final_path, i)
+        if not(os.path.exists(latencies_log)):
+            return None
+        latencies, _ = read_any_log(latencies_log)
+        hist.record(latencies[int(len(latencies) * STRIP_PERCENT):
+                              int(len(latencies) * (1.0 - STRIP_PERCENT))])
+    if len(hist) == 0:
+        return None
+    return hist
+
+def parse_folder(final_path, system, workload, trial, num_clients):
+    """
+    Summarizes one trial folder; returns a record keyed by CSV_FIELDS (plus
+    trial), or None if a client log is missing or incomplete.
+    """
     tputs = []
     p99s = []
+    p999s = []
+    p9999s = []
     medians = []
     avgs = []
     all_retries = 0
@@ -95,57 +128,63 @@ def parse_folder(f, final_path, system, workload, trial, num_clients):
         client_log = "{}/client{}.log".format(final_path, i)
         if not(os.path.exists(final_path)):
             debug("Path {} does not exist".format(final_path))
-            return
+            return None
         latencies = parse_log(client_err)
         retries = parse_log(client_log)
         if len(retries) != 0:
             all_retries += int(retries["retries"])
         if len(latencies) == 0:
             debug("Path {} has an error".format(final_path))
-            return
+            return None
         avg = latencies["avg"]/float(1000000) # milliseconds
         p99 = latencies["p99"]/float(1000) # microseconds
         median = latencies["median"]/float(1000) # microseconds
         avgs.append(avg)
         p99s.append(p99)
+        p999s.append(latencies["p999"]/float(1000))
+        p9999s.append(latencies["p9999"]/float(1000))
         medians.append(median)
-    avg = float(sum(avgs)) / len(avgs)
+    merged = merged_histogram(final_path, num_clients)
+    if merged is not None:
+        # quantiles over every request from every client
+        quantiles = merged.summary()
+        avg = quantiles["avg"]/float(1000000) # milliseconds
+        median = quantiles["median"]/float(1000) # microseconds
+        p99 = quantiles["p99"]/float(1000)
+        p999 = quantiles["p999"]/float(1000)
+        p9999 = quantiles["p9999"]/float(1000)
+        source = "latlog"
+    else:
+        # only per-client summaries: the max is an upper bound on the tail
+        avg = float(sum(avgs)) / len(avgs)
+        median = float(sum(medians)) / len(medians)
+        p99 = max(p99s)
+        p999 = max(p999s)
+        p9999 = max(p9999s)
+        source = "summary"
     tput = float(num_clients) / avg
-    median = float(sum(medians)) / len(medians)
-    p99 = max(p99s)
-    f.write("{},{},{},{},{},{},{},{}\n".format(
-            system, workload,
-            num_clients,median,
-            avg*1000,p99,
-            tput,
-            all_retries))
-
-def get_suffix(arg):
-    try:
-        return arg.split("_")[1]
-    except:
-        print(arg)
-        exit(1)
+    return {"system": system, "workload": workload, "trial": trial,
+            "num_clients": num_clients, "median": median, "avg": avg*1000,
+            "p99": p99, "tput": tput, "retries": all_retries, "p999": p999,
+            "p9999": p9999, "latency_source": source}
+
+def format_row(record):
+    return ",".join([str(record[field]) for field in CSV_FIELDS]) + "\n"
 
 def iterate(f, args):
-    current_path = Path(args.logfile)
-    for system_name in os.listdir(args.logfile):
-        if not(os.path.isdir(current_path / system_name)):
-            continue # extra files stored in directory
-        for workload in os.listdir(current_path / system_name):
-            for clients_name in os.listdir(current_path / system_name / workload):
-                num_clients = int(clients_name[0])
-                for trial_name in os.listdir((current_path / system_name / workload / clients_name )):                    
-                    trial = int(get_suffix(trial_name))
-                    final_path = ( current_path / system_name / workload / clients_name / trial_name)
-                    parse_folder(f, final_path, system_name, workload, trial, num_clients)
-                        
+    trials = walk_trials(args.logfile, LAYOUT)
+    records = parse_trials(parse_folder, trial_jobs(
+        trials, ["system", "workload", "trial", "num_clients"]))
+    for record in records:
+        if record is not None:
+            f.write(format_row(record))
+    return records
 
 def main():
     args = parse_args()
     outfile = "{}.log".format(args.outfile)
     f =  open(outfile, "w")
-    f.write("system,workload,num_clients,median,avg,p99,tput,retries\n")
+    f.write("{}\n".format(",".join(CSV_FIELDS)))
     iterate(f, args)
     f.flush()
     f.close()
@@ -1,5 +1,5 @@
-from common import cleanup, debug, run_exp, parse_params, get_parser
-from parse_data import parse_log, convert_tput
+from common import close_connections, cleanup, debug, run_exp, parse_params, get_parser
+from parse_data import parse_log, convert_tput, merged_histogram
 import os
 import argparse
 from pathlib import Path
@@ -46,11 +46,22 @@ def analyze_exp(data, final_path, num_clients):
         tput = 1.0 / avg * 1000
         debug("Client {} tput: {:.2f} req/ms, avg latency: {:.2f} us, p99: {:.2f} us, median: {:.2f} us, {} retries".format(i, tput, avg, p99, median, retries))
     # full tput
+    merged = merged_histogram(final_path, num_clients)
+    if merged is not None:
+        quantiles = merged.summary()
+        avg = quantiles["avg"]/float(1000)
+        p99 = quantiles["p99"]/float(1000)
+        median = quantiles["median"]/float(1000)
+        p999 = quantiles["p999"]/float(1000)
+        tput = 1.0 * num_clients / (avg) * 1000
+        debug("Tput: {:.2f} req/ms, avg: {:.2f} us, median: {:.2f} us, p99: {:.2f} us, p99.9: {:.2f} us, {} retries".format(tput, avg, median, p99, p999, all_retries))
+        return
+    # no per-request logs: mean of the per-client summaries
     avg = mean(avgs)
     p99 = mean(p99s)
     median = mean(medians)
     tput = 1.0 * num_clients / (avg) * 1000
-    debug("Tput: {:.2f} req/ms, avg: {:.2f} us, median: {:.2f} us, p99: {:.2f} us, {} retries".format(tput, avg, median, p99, all_retries))
+    debug("Tput: {:.2f} req/ms, avg: {:.2f} us, median: {:.2f} us, p99 (mean of clients): {:.2f} us, {} retries".format(tput, avg, median, p99, all_retries))
 
 def main():
     args = parse_args()
@@ -85,6 +96,7 @@ def main():
             trial = "trial_{}".format(n)
             path = full_path / trial
             analyze_exp(data, path, args.num_clients)
+    close_connections()
         
 if __name__ == '__main__':
     main()